@@ -0,0 +1,114 @@
+import os
+import hashlib
+from urllib.parse import urlparse
+from typing import Dict, List, Any, Tuple
+
+from .cache import normalize_text
+
+# Prompt budgets, in (estimated) tokens
+GRADE_CONTEXT_TOKENS = int(os.getenv("GRADE_CONTEXT_TOKENS", "3000"))
+GENERATE_CONTEXT_TOKENS = int(os.getenv("GENERATE_CONTEXT_TOKENS", "6000"))
+SNIPPET_MAX_TOKENS = int(os.getenv("SNIPPET_MAX_TOKENS", "600"))
+
+# Roughly 4 characters per token for English prose
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def make_snippet(text: str, origin: str, score: float = 0.0, id: str = None, **metadata) -> Dict[str, Any]:
+    """
+    A single retrieved passage. `id` is the vector ID for RAG matches;
+    web results fall back to a hash of their content.
+    """
+    text = text or ""
+    return {
+        "id": id or hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest(),
+        "text": text,
+        "origin": origin,
+        "score": float(score or 0.0),
+        **metadata
+    }
+
+
+def credibility(snippet: Dict[str, Any]) -> float:
+    """
+    Source weight used when ranking. Our own index only holds curated
+    official sources; web results are weighted by domain.
+    """
+    if snippet.get("origin") == "rag":
+        return 1.0
+    host = urlparse(snippet.get("url") or "").netloc.lower()
+    if host.endswith(".gov") or host.endswith(".mil"):
+        return 1.0
+    if host.endswith(".org") or host.endswith(".edu") or "energy" in host or "utility" in host:
+        return 0.85
+    return 0.6
+
+
+def format_snippet(snippet: Dict[str, Any]) -> str:
+    if snippet.get("origin") == "web":
+        return f"Source: {snippet.get('url')}\nContent: {snippet['text']}"
+    return f"""
+Source: {snippet.get('source')}
+Type: {snippet.get('type')}
+URL: {snippet.get('url') or 'N/A'}
+Content: {snippet['text']}
+"""
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " ..."
+
+
+def assemble_context(documents: List[Dict[str, Any]], token_budget: int) -> Tuple[str, Dict[str, Any]]:
+    """
+    Build the prompt context from retrieved snippets.
+
+    1. Dedupe by vector ID / content hash (overlapping queries return the same chunks).
+    2. Rank by relevance score weighted by source credibility.
+    3. Greedily pack snippets, each capped at SNIPPET_MAX_TOKENS, into `token_budget`.
+
+    Returns the context string and a report of what was kept and dropped.
+    """
+    by_key = {}
+    unique = []
+    dropped = []
+    for doc in documents:
+        if not isinstance(doc, dict) or not doc.get("text"):
+            continue
+        content_key = hashlib.sha1(normalize_text(doc["text"]).encode("utf-8")).hexdigest()
+        existing = by_key.get(doc.get("id")) or by_key.get(content_key)
+        if existing is not None:
+            existing["score"] = max(existing["score"], doc.get("score", 0.0))
+            dropped.append({"id": doc.get("id"), "url": doc.get("url"), "reason": "duplicate"})
+            continue
+        entry = dict(doc)
+        entry.setdefault("id", content_key)
+        entry.setdefault("score", 0.0)
+        by_key[entry["id"]] = by_key[content_key] = entry
+        unique.append(entry)
+
+    ranked = sorted(unique, key=lambda d: (-(d["score"] * credibility(d)), d["id"]))
+
+    parts = []
+    kept = []
+    used = 0
+    for doc in ranked:
+        block = format_snippet({**doc, "text": _truncate(doc["text"], SNIPPET_MAX_TOKENS)})
+        tokens = estimate_tokens(block)
+        if used + tokens > token_budget:
+            dropped.append({"id": doc["id"], "url": doc.get("url"), "reason": "budget"})
+            continue
+        parts.append(block)
+        kept.append(doc["id"])
+        used += tokens
+
+    report = {"kept": kept, "dropped": dropped, "tokens": used, "budget": token_budget}
+    print(f"Context: kept {len(kept)} snippets (~{used}/{token_budget} tokens), dropped {len(dropped)}")
+    return "\n\n".join(parts), report
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+# Written by scripts/embed.py at the end of every ingestion run
+COVERAGE_INDEX_PATH = os.getenv(
+    "COVERAGE_INDEX_PATH",
+    str(Path(__file__).parent.parent / "data" / "coverage_index.json")
+)
+# How often lookups check the index file for changes
+COVERAGE_REFRESH_SECONDS = float(os.getenv("COVERAGE_REFRESH_SECONDS", "5"))
+
+
+def build_coverage_index(documents: List[Dict]) -> Dict:
+    """
+    Build the zip -> {types, locations} map from ingest document metadata
+    (the same `zip_codes`, `type` and `location` fields upserted to Pinecone).
+    """
+    zip_codes: Dict[str, Dict[str, Set[str]]] = {}
+    for doc in documents:
+        for zip_code in doc.get("zip_codes") or []:
+            entry = zip_codes.setdefault(str(zip_code), {"types": set(), "locations": set()})
+            if doc.get("type"):
+                entry["types"].add(doc["type"])
+            if doc.get("location"):
+                entry["locations"].add(doc["location"])
+
+    return {
+        "generated_at": time.time(),
+        "zip_codes": {
+            z: {"types": sorted(e["types"]), "locations": sorted(e["locations"])}
+            for z, e in sorted(zip_codes.items())
+        }
+    }
+
+
+def write_coverage_index(documents: List[Dict], path: str = COVERAGE_INDEX_PATH) -> Dict:
+    """Write the coverage index atomically so a running server never reads a partial file."""
+    data = build_coverage_index(documents)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+    print(f"Wrote coverage index for {len(data['zip_codes'])} zip codes to {path}")
+    return data
+
+
+class CoverageIndex:
+    """
+    In-memory zip coverage lookup.
+    Reloads itself when the index file on disk changes (i.e. after ingestion).
+    """
+
+    def __init__(self, path: str = COVERAGE_INDEX_PATH, refresh_seconds: float = COVERAGE_REFRESH_SECONDS):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.generated_at: Optional[float] = None
+        self._types: Dict[str, Set[str]] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._mtime is not None
+
+    def load(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Coverage Index Load Error: {e}")
+            return False
+
+        self._types = {
+            z: set(entry.get("types", []))
+            for z, entry in data.get("zip_codes", {}).items()
+        }
+        self.generated_at = data.get("generated_at")
+        self._mtime = mtime
+        print(f"Loaded coverage index ({len(self._types)} zip codes)")
+        return True
+
+    def refresh(self) -> bool:
+        """Reload if the file changed since the last load, checking at most every refresh_seconds."""
+        now = time.monotonic()
+        if self.loaded and now - self._checked_at < self.refresh_seconds:
+            return True
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return self.loaded
+        if mtime != self._mtime:
+            return self.load()
+        return True
+
+    def lookup(self, zip_code: str, doc_type: str) -> Optional[bool]:
+        """
+        O(1) membership check. Returns None when no index has been built yet,
+        so callers can fall back to querying the vector store.
+        """
+        if not self.refresh():
+            return None
+        return doc_type in self._types.get(str(zip_code), ())
+
+
+coverage_index = CoverageIndex()
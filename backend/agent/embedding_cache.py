@@ -0,0 +1,225 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .cache import LRUCache, normalize_text
+
+# "off", "memory" (in-process LRU only) or "disk" (LRU + SQLite tier)
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "memory").lower()
+# Entries are float32 arrays, ~6 KB each for 1536 dims
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2000"))
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "200000"))
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    str(Path(__file__).parent.parent / "data" / "embedding_cache.sqlite3")
+)
+
+
+def cache_key(model: str, text: str, normalize: bool = False) -> str:
+    if normalize:
+        text = normalize_text(text)
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingStore:
+    """
+    On-disk embedding tier that survives restarts.
+    Vectors are stored as float32 blobs; the least recently used rows are
+    pruned once the table grows past `max_entries`.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_DISK_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            found.update(self._get_batch(keys[i:i + 500]))
+        return found
+
+    def _get_batch(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" for _ in keys)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                self._conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                    [time.time(), *[r[0] for r in rows]]
+                )
+                self._conn.commit()
+
+        return {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+
+    def set_many(self, model: str, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(k, model, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items.items()]
+            )
+            self._writes_since_prune += len(items)
+            if self._writes_since_prune >= 1000:
+                self._prune()
+            self._conn.commit()
+
+    def _prune(self):
+        self._writes_since_prune = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with an LRU tier and an optional SQLite tier.
+    Keys are (model name, text), so repeated queries such as the analyze_profile
+    fallbacks are only ever embedded once. With normalize=True the text is
+    case- and whitespace-folded first; only use that for search queries, never
+    for document chunks whose exact text is what gets stored.
+    Vectors are held as float32 arrays and returned as lists.
+    """
+
+    def __init__(self, inner: Embeddings, memory_size: int = EMBEDDING_CACHE_SIZE, disk: Optional[SQLiteEmbeddingStore] = None, normalize: bool = False):
+        self.inner = inner
+        self.model = getattr(inner, "model", type(inner).__name__)
+        self.memory = LRUCache(memory_size)
+        self.disk = disk
+        self.normalize = normalize
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _memory_lookup(self, texts: List[str]):
+        keys = [cache_key(self.model, t, self.normalize) for t in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None:
+                vectors[key] = vector
+        # Keys worth asking the disk tier for
+        pending = [k for k in dict.fromkeys(keys) if k not in vectors] if self.disk is not None else []
+        return keys, vectors, pending
+
+    def _missing(self, keys: List[str], texts: List[str], vectors: Dict[str, np.ndarray], from_disk: Dict[str, np.ndarray]) -> Dict[str, str]:
+        self.disk_hits += len(from_disk)
+        for key, vector in from_disk.items():
+            self.memory.set(key, vector)
+        vectors.update(from_disk)
+
+        # Unique texts that still need the provider, in first-seen order
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        return missing
+
+    def _lookup(self, texts: List[str]):
+        keys, vectors, pending = self._memory_lookup(texts)
+        from_disk = self.disk.get_many(pending) if pending else {}
+        return keys, vectors, self._missing(keys, texts, vectors, from_disk)
+
+    async def _alookup(self, texts: List[str]):
+        # SQLite calls block, so the disk tier is read off the event loop
+        keys, vectors, pending = self._memory_lookup(texts)
+        from_disk = await asyncio.to_thread(self.disk.get_many, pending) if pending else {}
+        return keys, vectors, self._missing(keys, texts, vectors, from_disk)
+
+    def _remember(self, missing_keys: List[str], new_vectors: List[List[float]], vectors: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        fresh = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing_keys, new_vectors)}
+        for key, vector in fresh.items():
+            self.memory.set(key, vector)
+        vectors.update(fresh)
+        return fresh
+
+    def _store(self, missing_keys: List[str], new_vectors: List[List[float]], vectors: Dict[str, np.ndarray]):
+        fresh = self._remember(missing_keys, new_vectors, vectors)
+        if self.disk is not None:
+            self.disk.set_many(self.model, fresh)
+
+    async def _astore(self, missing_keys: List[str], new_vectors: List[List[float]], vectors: Dict[str, np.ndarray]):
+        fresh = self._remember(missing_keys, new_vectors, vectors)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set_many, self.model, fresh)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            self._store(list(missing), self.inner.embed_documents(list(missing.values())), vectors)
+        return [vectors[k].tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self._lookup([text])
+        if missing:
+            self._store(keys, [self.inner.embed_query(text)], vectors)
+        return vectors[keys[0]].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = await self._alookup(texts)
+        if missing:
+            await self._astore(list(missing), await self.inner.aembed_documents(list(missing.values())), vectors)
+        return [vectors[k].tolist() for k in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = await self._alookup([text])
+        if missing:
+            await self._astore(keys, [await self.inner.aembed_query(text)], vectors)
+        return vectors[keys[0]].tolist()
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        return {
+            "model": self.model,
+            "memory_size": memory["size"],
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "disk_size": len(self.disk) if self.disk is not None else None
+        }
+
+
+def with_embedding_cache(embeddings: Embeddings, mode: str = EMBEDDING_CACHE, normalize: bool = False) -> Embeddings:
+    """Wrap `embeddings` according to EMBEDDING_CACHE ("off", "memory" or "disk")."""
+    if mode == "off":
+        return embeddings
+    disk = SQLiteEmbeddingStore() if mode == "disk" else None
+    return CachedEmbeddings(embeddings, disk=disk, normalize=normalize)
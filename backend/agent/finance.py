@@ -0,0 +1,168 @@
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+
+# IRS 25C: 30% of cost after rebates, capped per year. Heat pumps / boilers / biomass share
+# one $2,000 cap; everything else (windows, doors, insulation, electrical) shares $1,200.
+# 25D items (solar, batteries, geothermal) get 30% with no cap.
+CREDIT_RATE = 0.30
+HEAT_PUMP_CREDIT_CAP = 2000.0
+OTHER_CREDIT_CAP = 1200.0
+HEAT_PUMP_GROUP, OTHER_GROUP, UNCAPPED_GROUP = 0, 1, 2
+HEAT_PUMP_KEYWORDS = ("heat pump", "boiler", "biomass", "mini-split", "mini split")
+UNCAPPED_KEYWORDS = ("solar", "battery", "geothermal")
+
+# HEEHRA: share of project cost covered by income tier, per-item caps, $14,000 per household.
+# Unknown income is treated as moderate so we never promise 100% coverage by mistake.
+HEEHRA_COVERAGE = {"under_50k": 1.0, "50k_80k": 0.5, "80k_150k": 0.5, "over_150k": 0.0}
+HEEHRA_DEFAULT_COVERAGE = 0.5
+HEEHRA_HOUSEHOLD_CAP = 14000.0
+HEEHRA_ITEM_CAPS = [
+    (("heat pump water heater", "hpwh"), 1750.0),
+    (("heat pump", "mini-split", "mini split"), 8000.0),
+    (("electrical panel", "electric panel", "panel upgrade", "service upgrade"), 4000.0),
+    (("wiring",), 2500.0),
+    (("insulation", "air seal", "weatheriz", "ventilation"), 1600.0),
+    (("stove", "cooktop", "electric range", "induction range", "dryer"), 840.0),
+]
+HEEHRA_URL = "https://www.energy.gov/save/home-upgrades"
+# A tax_credit entry is the federal 25C/25D credit if its provider or URL says so; other
+# credits (state programs) are kept at the amount the LLM found, like utility rebates
+FEDERAL_CREDIT_MARKERS = ("irs", "25c", "25d", "federal")
+
+FINANCE_DISCOUNT_RATE = float(os.getenv("FINANCE_DISCOUNT_RATE", "0.05"))
+FINANCE_HORIZON_YEARS = int(os.getenv("FINANCE_HORIZON_YEARS", "10"))
+NO_PAYBACK_YEARS = 999.0
+SUMMARY_FIELDS = ("other_incentives", "heehra_rebate", "federal_credit", "total_incentives", "net_cost", "annual_savings", "npv", "ten_year_savings")
+
+
+def _is_heehra(item: Dict[str, Any]) -> bool:
+    return "heehra" in str(item.get("provider", "")).lower()
+
+
+def _is_federal_credit(item: Dict[str, Any]) -> bool:
+    if item.get("source_type") != "tax_credit" or _is_heehra(item):
+        return False
+    provider = str(item.get("provider", "")).lower()
+    return any(k in provider for k in FEDERAL_CREDIT_MARKERS) or "irs.gov" in str(item.get("url", "")).lower()
+
+
+def _credit_group(name: str) -> int:
+    if any(k in name for k in UNCAPPED_KEYWORDS):
+        return UNCAPPED_GROUP
+    if any(k in name for k in HEAT_PUMP_KEYWORDS):
+        return HEAT_PUMP_GROUP
+    return OTHER_GROUP
+
+
+def _heehra_item_cap(name: str) -> float:
+    if any(k in name for k in UNCAPPED_KEYWORDS):
+        return 0.0
+    for keywords, cap in HEEHRA_ITEM_CAPS:
+        if any(k in name for k in keywords):
+            return cap
+    return 0.0
+
+
+def _allocate(amounts: np.ndarray, cap: float) -> np.ndarray:
+    """Share one cap across items in order: each gets what's left of the cap after the ones before it."""
+    return np.diff(np.minimum(np.cumsum(amounts), cap), prepend=0.0)
+
+
+def compute_financials(recommendations: List[Dict[str, Any]], income_range: str = None) -> Dict[str, np.ndarray]:
+    """
+    Vectorized incentive and ROI math over every recommendation at once.
+    HEEHRA and federal credit amounts are computed here for items the LLM marked
+    eligible (a HEEHRA entry / an IRS tax_credit entry). Every other entry (utility
+    rebates, state credits, other grants) keeps the LLM's amount and reduces the
+    cost before HEEHRA and the 25C basis are worked out.
+    """
+    n = len(recommendations)
+    names = [f"{r.get('name', '')} {r.get('description', '')}".lower() for r in recommendations]
+    funding = [r.get("funding_breakdown") or [] for r in recommendations]
+
+    cost = np.array([max(float(r.get("estimated_cost") or 0), 0.0) for r in recommendations], dtype=np.float64).reshape(n)
+    monthly = np.array([float(r.get("estimated_monthly_savings") or 0) for r in recommendations], dtype=np.float64).reshape(n)
+    other = np.array([
+        sum(float(f.get("amount") or 0) for f in items if not _is_heehra(f) and not _is_federal_credit(f))
+        for items in funding
+    ], dtype=np.float64).reshape(n)
+    heehra_eligible = np.array([any(_is_heehra(f) for f in items) for items in funding], dtype=bool).reshape(n)
+    credit_eligible = np.array([any(_is_federal_credit(f) for f in items) for items in funding], dtype=bool).reshape(n)
+    group = np.array([_credit_group(name) for name in names], dtype=np.int64).reshape(n)
+    item_cap = np.array([_heehra_item_cap(name) for name in names], dtype=np.float64).reshape(n)
+
+    other = np.minimum(other, cost)
+    coverage = HEEHRA_COVERAGE.get(income_range, HEEHRA_DEFAULT_COVERAGE)
+    heehra = np.where(heehra_eligible, np.minimum(coverage * (cost - other), item_cap), 0.0)
+    heehra = _allocate(heehra, HEEHRA_HOUSEHOLD_CAP)
+
+    # 25C basis reduction: rebates and grants come off the cost before the 30%
+    basis = np.maximum(cost - other - heehra, 0.0)
+    credit = np.where(credit_eligible, CREDIT_RATE * basis, 0.0)
+    for credit_group, cap in ((HEAT_PUMP_GROUP, HEAT_PUMP_CREDIT_CAP), (OTHER_GROUP, OTHER_CREDIT_CAP)):
+        mask = group == credit_group
+        credit[mask] = _allocate(credit[mask], cap)
+
+    net_cost = np.maximum(cost - other - heehra - credit, 0.0)
+    annual = monthly * 12
+    payback = np.full(n, NO_PAYBACK_YEARS)
+    np.divide(net_cost, annual, out=payback, where=annual > 0)
+    annuity = np.sum((1 + FINANCE_DISCOUNT_RATE) ** -np.arange(1, FINANCE_HORIZON_YEARS + 1))
+
+    return {
+        "other_incentives": np.round(other, 2),
+        "heehra_rebate": np.round(heehra, 2),
+        "federal_credit": np.round(credit, 2),
+        "total_incentives": np.round(other + heehra + credit, 2),
+        "net_cost": np.round(net_cost, 2),
+        "annual_savings": np.round(annual, 2),
+        "payback_years": np.round(payback, 1),
+        "npv": np.round(annual * annuity - net_cost, 2),
+        "ten_year_savings": np.round(annual * 10 - net_cost, 2),
+    }
+
+
+def _rebuild_funding(items: List[Dict[str, Any]], heehra: float, credit: float) -> List[Dict[str, Any]]:
+    """
+    Set the computed HEEHRA and federal credit amounts on one entry each (dropping
+    duplicates) and leave every other entry as it is. A $0 entry is kept: it marks
+    the item eligible, so a later re-run (e.g. after filtering frees a shared cap)
+    can give it a real amount and the breakdown always matches `financials`.
+    """
+    rebuilt = []
+    heehra_entry = next((f for f in items if _is_heehra(f)), None)
+    credit_entry = next((f for f in items if _is_federal_credit(f)), None)
+    for f in items:
+        if f is heehra_entry:
+            rebuilt.append({**f, "amount": heehra, "url": f.get("url") or HEEHRA_URL})
+        elif f is credit_entry:
+            rebuilt.append({**f, "amount": credit})
+        elif not _is_heehra(f) and not _is_federal_credit(f):
+            rebuilt.append(f)
+    return rebuilt
+
+
+def apply_financials(roadmap: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Recompute every recommendation's incentives and ROI in place, and add a
+    roadmap-level financial_summary. Cheap enough to run on every request.
+    """
+    if roadmap is None:
+        raise ValueError("Chain returned None")
+
+    recommendations = roadmap.get("recommendations") or []
+    metrics = compute_financials(recommendations, (profile or {}).get("income_range"))
+
+    for i, rec in enumerate(recommendations):
+        values = {key: column[i].item() for key, column in metrics.items()}
+        rec["funding_breakdown"] = _rebuild_funding(rec.get("funding_breakdown") or [], values["heehra_rebate"], values["federal_credit"])
+        rec["roi_years"] = values["payback_years"]
+        rec["financials"] = values
+
+    roadmap["financial_summary"] = {
+        key: round(float(metrics[key].sum()), 2)
+        for key in SUMMARY_FIELDS
+    }
+    return roadmap
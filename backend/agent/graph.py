@@ -1,28 +1,42 @@
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableLambda
 from .state import AgentState
 from .nodes import (
     analyze_profile,
+    aanalyze_profile,
     route_zip_code,
+    aroute_zip_code,
     retrieve_local,
+    aretrieve_local,
     retrieve_hybrid,
+    aretrieve_hybrid,
     grade_documents,
+    agrade_documents,
     decide_to_generate,
-    generate_roadmap
+    rewrite_queries,
+    arewrite_queries,
+    generate_roadmap,
+    agenerate_roadmap
 )
 
+def _node(func, afunc, name):
+    # Sync graph runs (app.invoke) use func, async runs (app.ainvoke) use afunc
+    return RunnableLambda(func, afunc=afunc, name=name)
+
 workflow = StateGraph(AgentState)
 
-workflow.add_node("analyze", analyze_profile)
-workflow.add_node("retrieve_local", retrieve_local)
-workflow.add_node("retrieve_hybrid", retrieve_hybrid)
-workflow.add_node("grade", grade_documents)
-workflow.add_node("generate", generate_roadmap)
+workflow.add_node("analyze", _node(analyze_profile, aanalyze_profile, "analyze"))
+workflow.add_node("retrieve_local", _node(retrieve_local, aretrieve_local, "retrieve_local"))
+workflow.add_node("retrieve_hybrid", _node(retrieve_hybrid, aretrieve_hybrid, "retrieve_hybrid"))
+workflow.add_node("grade", _node(grade_documents, agrade_documents, "grade"))
+workflow.add_node("rewrite", _node(rewrite_queries, arewrite_queries, "rewrite"))
+workflow.add_node("generate", _node(generate_roadmap, agenerate_roadmap, "generate"))
 
 workflow.set_entry_point("analyze")
 
 workflow.add_conditional_edges(
     "analyze",
-    route_zip_code,
+    _node(route_zip_code, aroute_zip_code, "route_zip_code"),
     {
         "retrieve_local": "retrieve_local",
         "retrieve_hybrid": "retrieve_hybrid"
@@ -37,10 +51,12 @@ workflow.add_conditional_edges(
     decide_to_generate,
     {
         "generate": "generate",
-        "rewrite": "grade"
+        "rewrite": "rewrite"
     }
 )
 
+workflow.add_edge("rewrite", "grade")
+
 workflow.add_edge("generate", END)
 
 app = workflow.compile()
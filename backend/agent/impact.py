@@ -0,0 +1,135 @@
+import os
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from .cache import LRUCache, normalize_text
+
+# Set IMPACT_LLM_ANALOGIES=1 to have the LLM reword analogies; results are cached per (item, CO2 bucket)
+IMPACT_LLM_ANALOGIES = os.getenv("IMPACT_LLM_ANALOGIES", "0") == "1"
+ANALOGY_CACHE_SIZE = int(os.getenv("ANALOGY_CACHE_SIZE", "2048"))
+# Width of a CO2 bucket, in tons, for caching LLM analogies
+TONS_BUCKET = 0.1
+
+# calculate_co2_impact reports short tons (2000 lbs); EPA factors are per metric ton
+METRIC_TONS_PER_TON = 0.907185
+
+# EPA Greenhouse Gas Equivalencies: metric tons of CO2 per unit
+EQUIVALENCIES = [
+    {"key": "miles_driven", "per_unit": 3.93e-4,
+     "template": "This is like not driving {n} miles in an average gas-powered car."},
+    {"key": "coal_burned_lbs", "per_unit": 9.05e-4,
+     "template": "This is like not burning {n} pounds of coal."},
+    {"key": "phones_charged", "per_unit": 8.22e-6,
+     "template": "This is like the emissions from charging {n} smartphones."},
+    {"key": "gasoline_gallons", "per_unit": 8.887e-3,
+     "template": "This is like not burning {n} gallons of gasoline."},
+    {"key": "tree_seedlings", "per_unit": 0.060,
+     "template": "This is like the CO2 absorbed by {n} tree seedlings grown for 10 years."},
+]
+
+
+def equivalences(co2_tons: float) -> Dict[str, float]:
+    """All equivalences for `co2_tons` (short tons), keyed by unit."""
+    metric_tons = max(co2_tons, 0.0) * METRIC_TONS_PER_TON
+    return {e["key"]: metric_tons / e["per_unit"] for e in EQUIVALENCIES}
+
+
+def _format_count(n: float) -> str:
+    if n >= 100:
+        # Two significant figures reads better than false precision ("2,500" not "2,547")
+        digits = len(str(int(n))) - 2
+        return f"{int(round(n, -digits)):,}"
+    if n >= 10:
+        return f"{n:.0f}"
+    return f"{n:.1f}".rstrip("0").rstrip(".")
+
+
+def local_analogy(name: str, co2_tons: float) -> str:
+    """
+    Deterministic analogy for one item. The unit is picked from a hash of the
+    item name so a roadmap gets a mix of analogies, skipping units that would
+    read as less than one (e.g. "0.2 tree seedlings").
+    """
+    counts = equivalences(co2_tons)
+    start = int(hashlib.sha1(normalize_text(name or "").encode("utf-8")).hexdigest(), 16) % len(EQUIVALENCIES)
+    for offset in range(len(EQUIVALENCIES)):
+        equivalence = EQUIVALENCIES[(start + offset) % len(EQUIVALENCIES)]
+        if counts[equivalence["key"]] >= 1:
+            return equivalence["template"].format(n=_format_count(counts[equivalence["key"]]))
+    # Smartphones always reach one for any nonzero saving; this only covers zero
+    return "This upgrade's CO2 savings are too small to compare yet."
+
+
+ANALOGY_PROMPT = """You are an energy efficiency expert. Write one fun, relatable sentence comparing the CO2 saved by a home upgrade to an everyday activity.
+
+Upgrade: {name}
+CO2 saved per year: about {tons} tons
+Use one of these exact equivalences (do NOT invent or recalculate numbers):
+{equivalences}
+
+Return only the sentence."""
+
+
+class AnalogyEngine:
+    """
+    Turns co2_saved_tons into analogies locally. With an LLM configured, each
+    analogy is reworded once per (item name, CO2 bucket) and cached; any LLM
+    failure falls back to the local sentence.
+    """
+
+    def __init__(self, max_size: int = ANALOGY_CACHE_SIZE):
+        self._cache = LRUCache(max_size)
+
+    def _cache_key(self, name: str, co2_tons: float):
+        return normalize_text(name or ""), round(co2_tons / TONS_BUCKET)
+
+    def _enrich(self, name: str, co2_tons: float, llm) -> Optional[str]:
+        key = self._cache_key(name, co2_tons)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        bucket_tons = key[1] * TONS_BUCKET
+        lines = "\n".join(
+            e["template"].format(n=_format_count(n))
+            for e, n in zip(EQUIVALENCIES, equivalences(bucket_tons).values())
+            if n >= 1
+        )
+        try:
+            response = llm.invoke(ANALOGY_PROMPT.format(name=name, tons=f"{bucket_tons:.1f}", equivalences=lines))
+            text = str(response.content).strip().strip('"').strip()
+        except Exception as e:
+            print(f"Analogy enrichment failed for {name}: {e}")
+            return None
+        if not text or len(text) > 300:
+            return None
+        self._cache.set(key, text)
+        return text
+
+    def analogy(self, name: str, co2_tons: float, llm=None) -> str:
+        if llm is not None and co2_tons >= TONS_BUCKET / 2:
+            enriched = self._enrich(name, co2_tons, llm)
+            if enriched:
+                return enriched
+        return local_analogy(name, co2_tons)
+
+    def breakdown(self, items: List[Dict[str, Any]], llm=None) -> Dict[str, Dict[str, Any]]:
+        """
+        Impact breakdown for items with `name` and `co2_saved_tons`, in the
+        {name: {"analogy", "co2_saved_tons", "equivalents"}} shape stored in user_impact.
+        """
+        result = {}
+        for item in items:
+            tons = item.get("co2_saved_tons") or 0.0
+            result[item["name"]] = {
+                "analogy": self.analogy(item["name"], tons, llm),
+                "co2_saved_tons": tons,
+                "equivalents": {k: round(v, 1) for k, v in equivalences(tons).items()}
+            }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+analogy_engine = AnalogyEngine()
@@ -0,0 +1,228 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+# Per-model request rate and concurrency. LLM_RPM_OVERRIDES takes "model=rpm,model=rpm".
+LLM_RPM = float(os.getenv("LLM_RPM", "60"))
+LLM_RPM_OVERRIDES = os.getenv("LLM_RPM_OVERRIDES", "")
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+# How long a call may wait for a slot before giving up
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1.0"))
+
+
+class LLMQueueTimeout(TimeoutError):
+    """Raised when a call could not get a rate-limit slot before its deadline."""
+
+
+def _rpm_for(model: str) -> float:
+    for pair in LLM_RPM_OVERRIDES.split(","):
+        name, _, rpm = pair.partition("=")
+        if name.strip() == model and rpm.strip():
+            return float(rpm)
+    return LLM_RPM
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Quota / 429 errors from the Gemini SDK (ResourceExhausted) or any HTTP client."""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}"
+    return any(marker in text for marker in ("429", "ResourceExhausted", "RESOURCE_EXHAUSTED", "quota", "rate limit"))
+
+
+class ModelLimiter:
+    """
+    Token bucket (requests per minute, burst of max_in_flight) plus a cap on
+    in-flight calls for one model. Shared by sync callers (threads) and async
+    callers (event loop); waiters poll with short sleeps until their deadline.
+    """
+
+    def __init__(self, model: str, rpm: float, max_in_flight: int = LLM_MAX_IN_FLIGHT):
+        self.model = model
+        self.rate = rpm / 60.0
+        self.capacity = float(max(1, max_in_flight))
+        self.max_in_flight = max_in_flight
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+
+    def _try_acquire(self) -> float:
+        """Take a slot and return 0, or return how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._in_flight >= self.max_in_flight:
+                return 0.05
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._in_flight += 1
+                self.calls += 1
+                return 0.0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else 0.05
+
+    def _check_deadline(self, deadline: float, wait: float):
+        if time.monotonic() + wait > deadline:
+            with self._lock:
+                self.timed_out += 1
+            raise LLMQueueTimeout(f"No {self.model} slot within {LLM_QUEUE_TIMEOUT_SECONDS}s")
+
+    def acquire(self, deadline: float):
+        started = time.monotonic()
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                break
+            self._check_deadline(deadline, min(wait, 0.05))
+            time.sleep(min(wait, max(0.0, deadline - time.monotonic())))
+        self._waited(time.monotonic() - started)
+
+    async def aacquire(self, deadline: float):
+        started = time.monotonic()
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                break
+            self._check_deadline(deadline, min(wait, 0.05))
+            await asyncio.sleep(min(wait, max(0.0, deadline - time.monotonic())))
+        self._waited(time.monotonic() - started)
+
+    def _waited(self, seconds: float):
+        with self._lock:
+            self.wait_seconds += seconds
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def throttled(self):
+        """Upstream said 429: empty the bucket so every caller backs off, not just this one."""
+        with self._lock:
+            self.rate_limited += 1
+            self.retries += 1
+            self._tokens = min(self._tokens, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": self.rate * 60,
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "calls": self.calls,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "timed_out": self.timed_out,
+                "wait_seconds": round(self.wait_seconds, 3)
+            }
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model: str) -> ModelLimiter:
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(model, _rpm_for(model))
+        return _limiters[model]
+
+
+def gateway_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.model: limiter.stats() for limiter in limiters}
+
+
+def _backoff(attempt: int) -> float:
+    return min(30.0, LLM_BACKOFF_SECONDS * 2 ** attempt) * (0.5 + random.random())
+
+
+class LLMGateway(Runnable):
+    """
+    Drop-in wrapper around a chat model that routes every call through the
+    model's shared limiter and retries 429s with jittered backoff. It is a
+    Runnable, so `prompt | llm | parser` chains keep working.
+    Streams are only retried if they fail before the first chunk.
+    """
+
+    def __init__(self, llm: Runnable, model: Optional[str] = None):
+        self.llm = llm
+        self.model = model or getattr(llm, "model", None) or type(llm).__name__
+        self.limiter = get_limiter(self.model)
+
+    def _retry_or_raise(self, error: Exception, attempt: int) -> float:
+        if attempt >= LLM_MAX_RETRIES or not is_rate_limited(error):
+            raise error
+        self.limiter.throttled()
+        delay = _backoff(attempt)
+        print(f"{self.model} rate limited, retrying in {delay:.1f}s (attempt {attempt + 1}/{LLM_MAX_RETRIES})")
+        return delay
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.limiter.acquire(time.monotonic() + LLM_QUEUE_TIMEOUT_SECONDS)
+            try:
+                return self.llm.invoke(input, config, **kwargs)
+            except Exception as e:
+                delay = self._retry_or_raise(e, attempt)
+            finally:
+                self.limiter.release()
+            time.sleep(delay)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self.limiter.aacquire(time.monotonic() + LLM_QUEUE_TIMEOUT_SECONDS)
+            try:
+                return await self.llm.ainvoke(input, config, **kwargs)
+            except Exception as e:
+                delay = self._retry_or_raise(e, attempt)
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
+
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            self.limiter.acquire(time.monotonic() + LLM_QUEUE_TIMEOUT_SECONDS)
+            started = False
+            try:
+                for chunk in self.llm.stream(input, config, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = self._retry_or_raise(e, attempt)
+            finally:
+                self.limiter.release()
+            time.sleep(delay)
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            await self.limiter.aacquire(time.monotonic() + LLM_QUEUE_TIMEOUT_SECONDS)
+            started = False
+            try:
+                async for chunk in self.llm.astream(input, config, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                delay = self._retry_or_raise(e, attempt)
+            finally:
+                self.limiter.release()
+            await asyncio.sleep(delay)
@@ -1,20 +1,40 @@
 import os
 import json
+import time
 from typing import List, Dict, Any
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.outputs import Generation
+from langchain_core.runnables import RunnableConfig
+from langchain_core.callbacks.manager import adispatch_custom_event
 
-from .state import AgentState, RoadmapOutput, GradeDocuments
-from .utils import calculate_roi
-from .tools import retrieve_context, search_web, check_zip_coverage, llm, llm_flash_lite
+from .state import AgentState, RoadmapOutput, GradeDocuments, ComponentRecommendation
+from .structured_output import RoadmapDraft, parse_json_reply, validate_fragment, repair_roadmap, arepair_roadmap
+from .context import assemble_context, GRADE_CONTEXT_TOKENS, GENERATE_CONTEXT_TOKENS
+from .utils import run_bounded, arun_bounded
+from .finance import apply_financials
+from .query_planner import plan_queries, LLM_QUERY_PLANNER
+from .tools import (
+    retrieve_context,
+    aretrieve_context,
+    retrieve_contexts,
+    aretrieve_contexts,
+    search_web,
+    asearch_web,
+    check_zip_coverage,
+    acheck_zip_coverage,
+    llm,
+    llm_flash_lite
+)
 
-def analyze_profile(state: AgentState) -> Dict:
-    """Analyze survey data to generate search queries."""
-    print("Analyzing Profile...")
-    profile = state["user_profile"]
-    
-    prompt = f"""
+# Per-run budget for the grade -> rewrite loop
+AGENT_MAX_REWRITES = int(os.getenv("AGENT_MAX_REWRITES", "1"))
+AGENT_MAX_LLM_CALLS = int(os.getenv("AGENT_MAX_LLM_CALLS", "6"))
+AGENT_MAX_SECONDS = float(os.getenv("AGENT_MAX_SECONDS", "90"))
+
+def _analyze_prompt(profile: Dict) -> str:
+    return f"""
     Analyze this user profile for energy rebate eligibility:
     - Zip: {profile.get('zip_code')}
     - Home: {profile.get('ownership_status')}, {profile.get('home_type')}
@@ -26,20 +46,54 @@ def analyze_profile(state: AgentState) -> Dict:
     Focus on high-value upgrades (HVAC, Solar) and quick wins (Weatherization).
     Return ONLY a JSON list of strings, e.g. ["query1", "query2"]
     """
-    
-    response = llm.invoke(prompt)
+
+def _parse_queries(content: str, profile: Dict) -> List[str]:
     try:
-        # Simple parsing for list
-        queries = json.loads(response.content)
-    except:
-        # Fallback
-        queries = [
-            f"energy rebates {profile.get('zip_code')} {profile.get('heating_system')}",
-            f"federal tax credits {profile.get('ownership_status')}",
-            f"utility incentives {profile.get('zip_code')}"
-        ]
+        queries = parse_json_reply(content)
+        if isinstance(queries, list) and queries and all(isinstance(q, str) for q in queries):
+            return queries
+    except ValueError:
+        pass
+    # Fallback
+    return [
+        f"energy rebates {profile.get('zip_code')} {profile.get('heating_system')}",
+        f"federal tax credits {profile.get('ownership_status')}",
+        f"utility incentives {profile.get('zip_code')}"
+    ]
+
+def _planned_queries(profile: Dict):
+    """Rule-based queries, unless LLM_QUERY_PLANNER is set or the rules can't classify the profile."""
+    if LLM_QUERY_PLANNER:
+        return None
+    return plan_queries(profile)
+
+def analyze_profile(state: AgentState) -> Dict:
+    """Analyze survey data to generate search queries."""
+    print("Analyzing Profile...")
+    profile = state["user_profile"]
+    
+    queries = _planned_queries(profile)
+    if queries is not None:
+        return {"search_queries": queries, "observations": ["Analyzed profile (rules)."], "llm_calls": 0}
+    
+    response = llm.invoke(_analyze_prompt(profile))
+    queries = _parse_queries(response.content, profile)
         
-    return {"search_queries": queries, "observations": ["Analyzed profile."]}
+    return {"search_queries": queries, "observations": ["Analyzed profile."], "llm_calls": 1}
+
+async def aanalyze_profile(state: AgentState) -> Dict:
+    """Async variant of analyze_profile."""
+    print("Analyzing Profile...")
+    profile = state["user_profile"]
+    
+    queries = _planned_queries(profile)
+    if queries is not None:
+        return {"search_queries": queries, "observations": ["Analyzed profile (rules)."], "llm_calls": 0}
+    
+    response = await llm.ainvoke(_analyze_prompt(profile))
+    queries = _parse_queries(response.content, profile)
+        
+    return {"search_queries": queries, "observations": ["Analyzed profile."], "llm_calls": 1}
 
 def route_zip_code(state: AgentState) -> str:
     """Conditional Edge decision."""
@@ -48,33 +102,96 @@ def route_zip_code(state: AgentState) -> str:
         return "retrieve_local"
     return "retrieve_hybrid"
 
+async def aroute_zip_code(state: AgentState) -> str:
+    """Async variant of route_zip_code."""
+    zip_code = state["user_profile"].get("zip_code")
+    if await acheck_zip_coverage(zip_code):
+        return "retrieve_local"
+    return "retrieve_hybrid"
+
+def _merge_documents(results: List) -> List:
+    # Flatten per-query snippet lists in query order, dropping failed lookups.
+    # Duplicates are left for assemble_context to collapse.
+    return [snippet for r in results if r for snippet in r]
+
 def retrieve_local(state: AgentState) -> Dict:
     """Retrieve from local vector DB."""
     print("Retrieving Local RAG...")
-    docs = []
-    # Query for each generated topic + general federal
-    for q in state["search_queries"]:
-        context = retrieve_context(q, k=2) # Reuse existing function
-        docs.append(context)
+    # One batched embedding call, then concurrent index queries per topic
+    results = retrieve_contexts(state["search_queries"], k=2)
+        
+    return {"documents": _merge_documents(results)}
+
+async def aretrieve_local(state: AgentState) -> Dict:
+    """Async variant of retrieve_local."""
+    print("Retrieving Local RAG...")
+    results = await aretrieve_contexts(state["search_queries"], k=2)
         
-    return {"documents": docs}
+    return {"documents": _merge_documents(results)}
 
 def retrieve_hybrid(state: AgentState) -> Dict:
     """Retrieve from Hybrid (Federal + Web)."""
     print("Retrieving Hybrid...")
-    docs = []
     zip_code = state["user_profile"].get("zip_code")
     
-    # 1. Federal RAG
-    files_context = retrieve_context("federal tax credits", filters={"location": "federal"}, k=3)
-    docs.append(files_context)
+    # 1. Federal RAG, 2. Web Search -- all issued at once
+    calls = [lambda: retrieve_context("federal tax credits", filters={"location": "federal"}, k=3)]
+    calls += [
+        lambda q=q: search_web(f"{q} in {zip_code}")
+        for q in state["search_queries"]
+    ]
+        
+    return {"documents": _merge_documents(run_bounded(calls))}
+
+async def aretrieve_hybrid(state: AgentState) -> Dict:
+    """Async variant of retrieve_hybrid."""
+    print("Retrieving Hybrid...")
+    zip_code = state["user_profile"].get("zip_code")
     
-    # 2. Web Search
-    for q in state["search_queries"]:
-        web_res = search_web(f"{q} in {zip_code}")
-        docs.append(web_res)
+    calls = [lambda: aretrieve_context("federal tax credits", filters={"location": "federal"}, k=3)]
+    calls += [
+        lambda q=q: asearch_web(f"{q} in {zip_code}")
+        for q in state["search_queries"]
+    ]
         
-    return {"documents": docs}
+    return {"documents": _merge_documents(await arun_bounded(calls))}
+
+GRADE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a strict data evaluator. 
+        Your job is to Grade the retrieved documents for relevance, specificity, and CREDIBILITY.
+        
+        CREDIBILITY RULES:
+        - PASS: government sites (.gov), utility companies (austinenergy.com), official manufacturers (energy star).
+        - FAIL: generic blogs, content farms, "tips and tricks" articles, unverified forums.
+        
+        CONTENT RULES:
+        - PASS: Contains specific rebate amounts (e.g. "$2,000"), specific tax credit codes (25C), or income limits.
+        - FAIL: Generic advice like "install better windows" without specific financial details.
+        
+        Output 'yes' if the documents contain at least one credible, specific source of valid rebate information.
+        """),
+    ("human", "Documents:\n\n{context}\n\n{format_instructions}")
+])
+
+def _grade_result(state: AgentState, score: Dict) -> Dict:
+    print(f"  - Score: {score['binary_score']}")
+    print(f"  - Reason: {score['explanation']}")
+    
+    if score["binary_score"].lower() == "yes":
+        return {"observations": ["Found credible pricing data."], "llm_calls": 1}
+    else:
+         return {
+             "retry_count": state["retry_count"] + 1,
+             "observations": [f"Grade failed: {score['explanation']}"],
+             "llm_calls": 1
+         }
+
+def _grade_fallback(state: AgentState, combined_text: str, e: Exception) -> Dict:
+    print(f"Grading Error: {e}")
+    # Fallback to loose check
+    if "$" in combined_text:
+         return {"observations": ["Found specific pricing data (fallback)."], "llm_calls": 1}
+    return {"retry_count": state["retry_count"] + 1, "llm_calls": 1}
 
 def grade_documents(state: AgentState) -> Dict:
     """
@@ -87,73 +204,141 @@ def grade_documents(state: AgentState) -> Dict:
        - Reject generic "save money by turning off lights" advice.
     """
     print("Grading Documents...")
-    combined_text = "\n".join([str(d) for d in state["documents"]])
+    combined_text, report = assemble_context(state["documents"], GRADE_CONTEXT_TOKENS)
     
     # Fail fast if empty
     if not combined_text or len(combined_text) < 50:
-        return {"retry_count": state["retry_count"] + 1}
+        return {"retry_count": state["retry_count"] + 1, "context_report": report}
 
     parser = JsonOutputParser(pydantic_object=GradeDocuments)
+    chain = GRADE_PROMPT | llm_flash_lite | parser
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a strict data evaluator. 
-        Your job is to Grade the retrieved documents for relevance, specificity, and CREDIBILITY.
-        
-        CREDIBILITY RULES:
-        - PASS: government sites (.gov), utility companies (austinenergy.com), official manufacturers (energy star).
-        - FAIL: generic blogs, content farms, "tips and tricks" articles, unverified forums.
-        
-        CONTENT RULES:
-        - PASS: Contains specific rebate amounts (e.g. "$2,000"), specific tax credit codes (25C), or income limits.
-        - FAIL: Generic advice like "install better windows" without specific financial details.
-        
-        Output 'yes' if the documents contain at least one credible, specific source of valid rebate information.
-        """),
-        ("human", "Documents:\n\n{context}\n\n{format_instructions}")
-    ])
+    try:
+        score = chain.invoke({
+            "context": combined_text,
+            "format_instructions": parser.get_format_instructions()
+        })
+        return {**_grade_result(state, score), "context_report": report}
+    except Exception as e:
+        return {**_grade_fallback(state, combined_text, e), "context_report": report}
+
+async def agrade_documents(state: AgentState) -> Dict:
+    """Async variant of grade_documents."""
+    print("Grading Documents...")
+    combined_text, report = assemble_context(state["documents"], GRADE_CONTEXT_TOKENS)
     
-    chain = prompt | llm_flash_lite | parser
+    if not combined_text or len(combined_text) < 50:
+        return {"retry_count": state["retry_count"] + 1, "context_report": report}
+
+    parser = JsonOutputParser(pydantic_object=GradeDocuments)
+    chain = GRADE_PROMPT | llm_flash_lite | parser
     
     try:
-        score = chain.invoke({
+        score = await chain.ainvoke({
             "context": combined_text,
             "format_instructions": parser.get_format_instructions()
         })
-        
-        print(f"  - Score: {score['binary_score']}")
-        print(f"  - Reason: {score['explanation']}")
-        
-        if score["binary_score"].lower() == "yes":
-            return {"observations": ["Found credible pricing data."]}
-        else:
-             return {"retry_count": state["retry_count"] + 1}
-             
+        return {**_grade_result(state, score), "context_report": report}
     except Exception as e:
-        print(f"Grading Error: {e}")
-        # Fallback to loose check
-        if "$" in combined_text:
-             return {"observations": ["Found specific pricing data (fallback)."]}
-        return {"retry_count": state["retry_count"] + 1}
+        return {**_grade_fallback(state, combined_text, e), "context_report": report}
 
 
+def _within_budget(state: AgentState) -> bool:
+    rewrites_done = max(0, state["retry_count"] - 1)
+    if rewrites_done >= AGENT_MAX_REWRITES:
+        return False
+    # A rewrite costs one call, then one more grade and the final generate
+    if state.get("llm_calls", 0) + 3 > AGENT_MAX_LLM_CALLS:
+        return False
+    started_at = state.get("started_at")
+    if started_at and time.time() - started_at > AGENT_MAX_SECONDS:
+        return False
+    return True
+
 def decide_to_generate(state: AgentState) -> str:
     """Conditional Edge for ReAct loop."""
-    # Simple check: if we have observations of success or max retries
-    if state["observations"] and "Found credible pricing data." in state["observations"][-1]:
+    # Simple check: if we have observations of success or the budget is spent
+    last = state["observations"][-1] if state["observations"] else ""
+    if "Found credible pricing data." in last or "Found specific pricing data (fallback)." in last:
         return "generate"
 
-    if state["retry_count"] >= 3:
+    if not _within_budget(state):
+        print("Rewrite budget spent, generating with current documents")
         return "generate"
     return "rewrite"
 
-def generate_roadmap(state: AgentState) -> Dict:
-    """Generate the final JSON roadmap."""
-    print("Generating Roadmap...")
+def _rewrite_prompt(state: AgentState) -> str:
+    profile = state["user_profile"]
+    feedback = [o for o in state["observations"] if o.startswith("Grade failed:")]
+    return f"""
+    Previous web searches for energy rebates did not return credible, specific results.
+    - Zip: {profile.get('zip_code')}
+    - Home: {profile.get('ownership_status')}, {profile.get('home_type')}
+    - Heating: {profile.get('heating_system')}
+    - Grader feedback: {feedback[-1] if feedback else 'none'}
+    - Queries already tried: {json.dumps(state["search_queries"])}
+    
+    Generate 2 NEW search queries that target official sources (.gov sites, the local
+    utility company, ENERGY STAR) and specific dollar amounts or eligibility rules.
+    Do not repeat the queries already tried.
+    Return ONLY a JSON list of strings, e.g. ["query1", "query2"]
+    """
+
+def _new_queries(content: str, state: AgentState) -> List[str]:
     profile = state["user_profile"]
-    context = "\n".join([str(d) for d in state["documents"]])
+    tried = {q.lower() for q in state["search_queries"]}
+    fallback = [
+        f"official utility rebate program {profile.get('zip_code')} {profile.get('heating_system')}",
+        f"site:.gov home energy rebates {profile.get('zip_code')}"
+    ]
+    try:
+        queries = [q for q in json.loads(content) if isinstance(q, str)]
+    except:
+        queries = []
+    fresh = [q for q in queries if q.lower() not in tried]
+    # Never re-grade identical documents: fall back to templates if nothing new came back
+    return (fresh or [q for q in fallback if q.lower() not in tried])[:2]
+
+def rewrite_queries(state: AgentState) -> Dict:
+    """Rewrite the search queries after a failed grade and retrieve only the new results."""
+    print("Rewriting Queries...")
+    zip_code = state["user_profile"].get("zip_code")
     
-    parser = JsonOutputParser(pydantic_object=RoadmapOutput)
+    response = llm_flash_lite.invoke(_rewrite_prompt(state))
+    queries = _new_queries(response.content, state)
+    
+    results = run_bounded([
+        lambda q=q: search_web(f"{q} in {zip_code}")
+        for q in queries
+    ])
+    
+    return {
+        "search_queries": state["search_queries"] + queries,
+        "documents": state["documents"] + _merge_documents(results),
+        "observations": [f"Rewrote queries: {queries}"],
+        "llm_calls": 1
+    }
+
+async def arewrite_queries(state: AgentState) -> Dict:
+    """Async variant of rewrite_queries."""
+    print("Rewriting Queries...")
+    zip_code = state["user_profile"].get("zip_code")
     
+    response = await llm_flash_lite.ainvoke(_rewrite_prompt(state))
+    queries = _new_queries(response.content, state)
+    
+    results = await arun_bounded([
+        lambda q=q: asearch_web(f"{q} in {zip_code}")
+        for q in queries
+    ])
+    
+    return {
+        "search_queries": state["search_queries"] + queries,
+        "documents": state["documents"] + _merge_documents(results),
+        "observations": [f"Rewrote queries: {queries}"],
+        "llm_calls": 1
+    }
+
 ROADMAP_PROMPT_TEMPLATE = """
         User Profile: {profile}
         
@@ -163,90 +348,136 @@ ROADMAP_PROMPT_TEMPLATE = """
         Task:
         Generate a personalized energy roadmap JSON data structure.
         
-        CRITICAL FINANCIAL LOGIC RULES (STRICT COMPLIANCE REQUIRED):
-        1. IRS 25C BASIS REDUCTION: 
-           - You MUST subtract any "Utility Rebates" or "Public Grants" (like HEEHRA) from the "Estimated Cost" BEFORE calculating the Federal Tax Credit.
-           - Formula: Federal Credit = 30% * (Estimated Cost - Utility Rebate - HEEHRA Rebate).
-           - Tax Credit Cap: Max $2,000/yr for Heat Pumps/Biomass/Boilers. Max $1,200/yr for everything else combined (Windows, Doors, Insulation, Electrical).
+        FUNDING RULES:
+        Federal tax credit, HEEHRA and ROI amounts are calculated for you afterwards. Do NOT calculate them.
+        1. ELIGIBILITY, NOT MATH:
+           - Add a "tax_credit" entry with provider "IRS 25C" or "IRS 25D" (amount 0, IRS.gov URL) only if the item qualifies for that federal credit.
+           - Add a "future_grant" entry with provider "HEEHRA" (amount 0) only if the item is a HEEHRA-eligible electrification upgrade.
+           - **AVAILABILITY CHECK**: If the state (e.g. Texas) does not have HEEHRA active yet, you MUST explicitly advise the user to "WAIT TO BUY" in the item description.
         
-        2. HEEHRA INCOME TIERS (Rebate Caps):
-           - Look at User Income.
-           - LOW INCOME (<80% Area Median Income): 100% of project cost covered (up to $14k).
-           - MODERATE INCOME (80-150% AMI): ONLY 50% of project cost covered (up to $14k).
-           - HIGH INCOME (>150% AMI): $0 HEEHRA rebate.
-           - RULE: If Income is >$50k and single/small household, or if unknown, ASSUME MODERATE INCOME (50% coverage). DO NOT promise 100% coverage unless you are certain they are Low Income.
-           - **AVAILABILITY CHECK**: If the state (e.g. Texas) does not have HEEHRA active yet, or if you mark it as a "future_grant", you MUST explicitly advise the user to "WAIT TO BUY" in the item description. Make it clear they will miss the money if they buy now.
+        2. OTHER INCENTIVES: Give each utility rebate ("instant_rebate"), state tax credit ("tax_credit") and other grant ("future_grant") its own entry with the provider and amount from the context.
+           - If a specific rebate amount is ambiguous, choose the LOWER expected amount. Do NOT double count incentives.
+           - Estimate costs and monthly savings conservatively, sized to the monthly bill bands in the profile. Savings can never exceed the bill.
         
         3. NON-REFUNDABLE WARNING:
-           - You MUST include a warning field or text stating: "Federal Tax Credits (25C) are non-refundable. You must have enough tax liability to claim them. They do not carry over."
-        
-        4. SPECIFICITY & CONSERVATISM:
-           - If a specific rebate amount is ambiguous, choose the LOWER expected amount.
-           - Do NOT double count incentives.
+           - You MUST include text stating: "Federal Tax Credits (25C) are non-refundable. You must have enough tax liability to claim them. They do not carry over."
            
-        5. URL CHECK: Map SPECIFIC URLs to their funding sources in the breakdown.
+        4. URL CHECK: Map SPECIFIC URLs to their funding sources in the breakdown.
            - **HEEHRA FALLBACK**: If you cannot find a specific state application link for HEEHRA, you MUST use "https://www.energy.gov/save/home-upgrades". DO NOT return a broken or hallucinated link.
            
-        6. DE-COUPLE COMBINED TOTALS:
-           - If you find a total savings of $2,800 that consists of an $800 utility check and a $2,000 tax credit, do NOT sum them. 
-           - Output them as two separate objects in the `funding_breakdown` list.
-           - For Federal Tax Credits (IRA/25C), always link to the official EnergyStar.gov or IRS.gov page.
-           
         Steps:
         1. Identify "Quick Wins" (Low cost).
         2. Identify "Big Bets" (Major upgrades).
-        3. EXTRACT detailed funding breakdown for each item.
-        4. Estimate ROI Years.
-        5. Calculate total projected yearly savings.
+        3. EXTRACT the funding sources for each item.
         
         {format_instructions}
         """
 
+ROADMAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are GreenGain, a STRICT expert energy financial advisor. Return purely JSON."),
+    ("human", ROADMAP_PROMPT_TEMPLATE)
+])
+
+def _preview_recommendation(rec: Dict, profile: Dict) -> Dict:
+    # Figures for this item alone, so they are provisional: the final roadmap shares credit caps across items
+    return apply_financials({"recommendations": [dict(rec)]}, profile)["recommendations"][0]
+
+async def _dispatch_recommendation(rec: Dict, config: RunnableConfig):
+    try:
+        await adispatch_custom_event("recommendation", rec, config=config)
+    except Exception as e:
+        # There may be no parent run to report to
+        print(f"Recommendation event skipped: {e}")
+
+def _remaining_llm_calls(state: AgentState, spent: int) -> int:
+    """What is left of AGENT_MAX_LLM_CALLS after the run so far plus `spent` calls in this node."""
+    return AGENT_MAX_LLM_CALLS - state.get("llm_calls", 0) - spent
+
 def generate_roadmap(state: AgentState) -> Dict:
-    """Generate the final JSON roadmap."""
+    """
+    Generate the final JSON roadmap.
+    Recommendations that fail schema validation are repaired individually
+    (bounded by STRUCTURED_REPAIR_BUDGET and what is left of AGENT_MAX_LLM_CALLS)
+    instead of discarding the whole generation.
+    """
     print("Generating Roadmap...")
     profile = state["user_profile"]
-    context = "\n".join([str(d) for d in state["documents"]])
+    context, report = assemble_context(state["documents"], GENERATE_CONTEXT_TOKENS)
     
     parser = JsonOutputParser(pydantic_object=RoadmapOutput)
+    chain = ROADMAP_PROMPT | llm
     
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are GreenGain, a STRICT expert energy financial advisor. Return purely JSON."),
-        ("human", ROADMAP_PROMPT_TEMPLATE)
-    ])
-    
-    chain = prompt | llm | parser
-    
+    llm_calls = 1
     try:
         response = chain.invoke({
             "profile": str(profile),
             "context": context,
             "format_instructions": parser.get_format_instructions()
         })
-        
-        if response is None:
-            raise ValueError("Chain returned None")
-
-        for rec in response.get("recommendations", []):
-            if rec["type"] == "big_bet" and rec["estimated_cost"] > 0:
-                # Calculate derived totals for ROI logic
-                funding = rec.get("funding_breakdown", [])
-                
-                total_rebate = sum(f["amount"] for f in funding if f["source_type"] in ["instant_rebate", "future_grant"])
-                total_credit = sum(f["amount"] for f in funding if f["source_type"] == "tax_credit")
-                
-                metrics = calculate_roi(
-                    rec["estimated_cost"], 
-                    total_rebate,
-                    total_credit, 
-                    rec["estimated_monthly_savings"]
-                )
-                rec["roi_years"] = metrics["roi_years"]
-                
-        return {"final_roadmap": response}
+        draft = RoadmapDraft(parse_json_reply(response.content))
+        roadmap, repairs = repair_roadmap(draft, llm_flash_lite, remaining=_remaining_llm_calls(state, llm_calls))
+        llm_calls += repairs
+        if roadmap is None:
+            raise ValueError("No valid recommendations in generation")
+        return {"final_roadmap": apply_financials(roadmap, profile), "llm_calls": llm_calls, "context_report": report}
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Generation Error: {e}")
-        return {"final_roadmap": None}
+        return {"final_roadmap": None, "llm_calls": llm_calls}
 
+async def agenerate_roadmap(state: AgentState, config: RunnableConfig = None) -> Dict:
+    """
+    Async variant of generate_roadmap.
+    
+    Streams the LLM output and dispatches a "recommendation" custom event as
+    soon as each item in the recommendations list is complete and valid, so
+    streaming callers (app.astream_events) can forward items before the JSON
+    is done. Repaired items are dispatched once the generation finishes.
+    """
+    print("Generating Roadmap...")
+    profile = state["user_profile"]
+    context, report = assemble_context(state["documents"], GENERATE_CONTEXT_TOKENS)
+    
+    parser = JsonOutputParser(pydantic_object=RoadmapOutput)
+    chain = ROADMAP_PROMPT | llm
+    
+    llm_calls = 1
+    try:
+        text = ""
+        completed = 0
+        dispatched = set()
+        async for chunk in chain.astream({
+            "profile": str(profile),
+            "context": context,
+            "format_instructions": parser.get_format_instructions()
+        }, config=config):
+            if not isinstance(chunk.content, str) or not chunk.content:
+                continue
+            text += chunk.content
+            
+            partial = parser.parse_result([Generation(text=text)], partial=True)
+            recs = partial.get("recommendations") if isinstance(partial, dict) else None
+            # Every item before the last one in a partial list is complete
+            while recs and len(recs) - 1 > completed:
+                rec, _ = validate_fragment(ComponentRecommendation, recs[completed])
+                if rec is not None:
+                    await _dispatch_recommendation(_preview_recommendation({**recs[completed], **rec}, profile), config)
+                    dispatched.add(completed)
+                completed += 1
+        
+        draft = RoadmapDraft(parse_json_reply(text))
+        roadmap, repairs = await arepair_roadmap(draft, llm_flash_lite, remaining=_remaining_llm_calls(state, llm_calls))
+        llm_calls += repairs
+        if roadmap is None:
+            raise ValueError("No valid recommendations in generation")
+        response = apply_financials(roadmap, profile)
+        for index in sorted(draft.valid):
+            if index not in dispatched:
+                await _dispatch_recommendation(draft.valid[index], config)
+        return {"final_roadmap": response, "llm_calls": llm_calls, "context_report": report}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Generation Error: {e}")
+        return {"final_roadmap": None, "llm_calls": llm_calls}
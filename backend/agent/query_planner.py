@@ -0,0 +1,84 @@
+import os
+import re
+import datetime
+from typing import Any, Dict, List, Optional
+
+# Set LLM_QUERY_PLANNER=1 to always plan search queries with the LLM instead of the rules below
+LLM_QUERY_PLANNER = os.getenv("LLM_QUERY_PLANNER", "0") == "1"
+
+# Survey option values (frontend/app/survey) -> the high-value HVAC upgrade worth searching for
+HEATING_QUERIES = {
+    "gas_furnace": "heat pump rebate replacing gas furnace",
+    "electric_baseboard": "ductless mini-split heat pump rebate replacing electric baseboard heat",
+    "heat_pump": "heat pump water heater rebate",
+    "oil_propane": "heat pump rebate converting from oil or propane heating",
+    "other": "heat pump installation rebate",
+}
+OWNERSHIP = {"own", "rent"}
+HOME_TYPES = {"single_family", "condo", "apartment"}
+# HEEHRA pays 100% of costs under 80% of area median income and 50% up to 150%
+INCOME_QUERIES = {
+    "under_50k": "HEEHRA low-income home electrification rebate",
+    "50k_80k": "HEEHRA moderate-income home electrification rebate",
+    "80k_150k": "Inflation Reduction Act home energy rebates moderate income",
+    "over_150k": "25C energy efficient home improvement tax credit",
+}
+# Homes built before this year usually need insulation and air sealing first
+WEATHERIZATION_BEFORE = 2000
+
+_ZIP_RE = re.compile(r"^\d{5}$")
+
+
+def _known(value: Any, allowed) -> bool:
+    """Missing optional answers are fine; free-text answers outside the survey options are not."""
+    return value in (None, "") or value in allowed
+
+
+def plan_queries(profile: Dict[str, Any]) -> Optional[List[str]]:
+    """
+    Build the three search queries (HVAC, funding, quick win) from survey fields.
+    Returns None if the profile falls outside what the rules understand, in
+    which case the caller should fall back to the LLM planner.
+    """
+    zip_code = str(profile.get("zip_code") or "")
+    heating = profile.get("heating_system")
+    ownership = profile.get("ownership_status")
+    home_type = profile.get("home_type")
+    income = profile.get("income_range")
+    year = profile.get("home_age_year")
+
+    if not _ZIP_RE.match(zip_code) or heating not in HEATING_QUERIES:
+        return None
+    if not (_known(ownership, OWNERSHIP) and _known(home_type, HOME_TYPES) and _known(income, INCOME_QUERIES)):
+        return None
+    if year is not None:
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            return None
+        # Anything else is probably the home's age rather than its build year
+        if not 1800 <= year <= datetime.date.today().year:
+            return None
+
+    renter = ownership == "rent"
+    multifamily = home_type in ("condo", "apartment")
+
+    hvac = HEATING_QUERIES[heating]
+    if renter:
+        hvac = "renter friendly window heat pump and portable appliance rebate"
+
+    if renter:
+        funding = "energy efficiency programs for renters"
+    elif income:
+        funding = INCOME_QUERIES[income]
+    else:
+        funding = "federal tax credits and rebates for homeowners"
+
+    if year is not None and year < WEATHERIZATION_BEFORE and not renter:
+        quick_win = "insulation and air sealing weatherization rebate"
+    elif renter or multifamily:
+        quick_win = "smart thermostat rebate"
+    else:
+        quick_win = "rooftop solar incentive"
+
+    return [f"{hvac} {zip_code}", f"{funding} {zip_code}", f"{quick_win} {zip_code}"]
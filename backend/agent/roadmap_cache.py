@@ -0,0 +1,121 @@
+import os
+import copy
+import json
+import hashlib
+from typing import Dict, Any, Optional
+
+from .cache import TTLCache
+from .coverage import coverage_index
+from .finance import apply_financials
+
+ROADMAP_CACHE_TTL_SECONDS = float(os.getenv("ROADMAP_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+ROADMAP_CACHE_SIZE = int(os.getenv("ROADMAP_CACHE_SIZE", "2048"))
+
+# Survey fields that actually change what the agent retrieves and recommends.
+# Bills feed the savings estimates, so they are part of the profile as coarse bands;
+# exact amounts are applied per user by personalize_roadmap().
+PROFILE_FIELDS = ["zip_code", "ownership_status", "home_type", "heating_system", "home_age_year", "income_range"]
+BILL_FIELDS = ["monthly_electric_bill", "monthly_gas_bill"]
+BILL_BAND_WIDTH = int(os.getenv("BILL_BAND_WIDTH", "50"))
+BILL_BAND_MAX = int(os.getenv("BILL_BAND_MAX", "400"))
+
+
+def bill_band(amount: Optional[float]) -> Optional[str]:
+    """Bucket a monthly bill into a band such as "$100-150", or "$400+" above BILL_BAND_MAX."""
+    if amount is None:
+        return None
+    amount = max(float(amount), 0.0)
+    if amount >= BILL_BAND_MAX:
+        return f"${BILL_BAND_MAX}+"
+    low = int(amount // BILL_BAND_WIDTH * BILL_BAND_WIDTH)
+    return f"${low}-{low + BILL_BAND_WIDTH}"
+
+
+def canonical_profile(survey: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reduce a survey to the fields the agent uses, normalized so that
+    equivalent surveys produce the same profile. Build year is bucketed
+    by decade since the prompts only care about the age of the home, and
+    bills by BILL_BAND_WIDTH dollars.
+    """
+    profile = {}
+    for field in PROFILE_FIELDS:
+        value = survey.get(field)
+        if isinstance(value, str):
+            value = " ".join(value.split()).lower() or None
+        if field == "zip_code" and value:
+            value = value[:5]
+        if field == "home_age_year" and value:
+            value = int(value) // 10 * 10
+        profile[field] = value
+    for field in BILL_FIELDS:
+        profile[f"{field}_band"] = bill_band(survey.get(field))
+    return profile
+
+
+def profile_fingerprint(profile: Dict[str, Any]) -> str:
+    """
+    Stable hash of a canonical profile plus the current RAG ingest generation,
+    so re-ingesting the index implicitly invalidates every cached roadmap.
+    """
+    payload = json.dumps({"profile": profile, "ingest": coverage_index.generated_at}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def monthly_bill(survey: Dict[str, Any]) -> Optional[float]:
+    bills = [survey.get("monthly_electric_bill"), survey.get("monthly_gas_bill")]
+    if not any(b is not None for b in bills):
+        return None
+    return sum(b or 0 for b in bills)
+
+
+def personalize_recommendation(rec: Dict, survey: Dict[str, Any]) -> Dict:
+    """
+    Cap a recommendation's monthly savings at what the user actually pays
+    per month, recomputing ROI for capped items. Returns a copy.
+    """
+    rec = copy.deepcopy(rec)
+    bill = monthly_bill(survey)
+    savings = rec.get("estimated_monthly_savings") or 0
+    if bill and bill > 0 and savings > bill:
+        rec["estimated_monthly_savings"] = bill
+        rec = apply_financials({"recommendations": [rec]}, survey)["recommendations"][0]
+    return rec
+
+
+def personalize_roadmap(roadmap: Dict, survey: Dict[str, Any]) -> Dict:
+    """
+    Apply per-user details (name, exact bill amounts) to a possibly shared
+    cached roadmap, then recompute incentives and ROI across all items.
+    """
+    roadmap = copy.deepcopy(roadmap)
+    if survey.get("name"):
+        roadmap["prepared_for"] = survey["name"]
+    roadmap["recommendations"] = [
+        personalize_recommendation(rec, survey)
+        for rec in roadmap.get("recommendations", [])
+    ]
+    return apply_financials(roadmap, survey)
+
+
+class RoadmapCache:
+    """TTL cache of raw agent roadmaps keyed on profile_fingerprint()."""
+
+    def __init__(self, max_size: int = ROADMAP_CACHE_SIZE, ttl: float = ROADMAP_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(max_size, ttl)
+
+    def get(self, profile: Dict[str, Any]) -> Optional[Dict]:
+        coverage_index.refresh()
+        return self._cache.get(profile_fingerprint(profile))
+
+    def set(self, profile: Dict[str, Any], roadmap: Dict):
+        self._cache.set(profile_fingerprint(profile), copy.deepcopy(roadmap))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+roadmap_cache = RoadmapCache()
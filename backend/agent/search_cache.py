@@ -0,0 +1,81 @@
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from .cache import TTLCache, SingleFlight, normalize_text
+
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", str(60 * 60)))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+
+
+class SearchCache:
+    """
+    TTL cache for web search results keyed on the normalized query.
+    Concurrent identical lookups are coalesced into a single upstream call,
+    and the upstream latency avoided by hits and coalesced waiters is tracked.
+    Failed lookups are never cached.
+    """
+
+    def __init__(self, max_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL_SECONDS):
+        self._cache = TTLCache(max_size, ttl)
+        self._flights = SingleFlight()
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _hit(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        self.saved_seconds += entry[1]
+        return entry
+
+    def _record(self, key: str, result: Any, started: float):
+        latency = time.monotonic() - started
+        self.upstream_calls += 1
+        self.upstream_seconds += latency
+        entry = (result, latency)
+        self._cache.set(key, entry)
+        return entry
+
+    def get_or_fetch(self, query: str, fetch: Callable[[str], Any]) -> Any:
+        key = normalize_text(query)
+        entry = self._hit(key)
+        if entry is not None:
+            return entry[0]
+
+        def _fetch():
+            started = time.monotonic()
+            return self._record(key, fetch(query), started)
+
+        (result, latency), shared = self._flights.do(key, _fetch)
+        if shared:
+            self.saved_seconds += latency
+        return result
+
+    async def aget_or_fetch(self, query: str, fetch: Callable[[str], Awaitable[Any]]) -> Any:
+        key = normalize_text(query)
+        entry = self._hit(key)
+        if entry is not None:
+            return entry[0]
+
+        async def _fetch():
+            started = time.monotonic()
+            return self._record(key, await fetch(query), started)
+
+        (result, latency), shared = await self._flights.ado(key, _fetch)
+        if shared:
+            self.saved_seconds += latency
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._cache.stats(),
+            "coalesced": self._flights.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_seconds": round(self.upstream_seconds, 3),
+            "saved_seconds": round(self.saved_seconds, 3)
+        }
+
+
+search_cache = SearchCache()
@@ -2,7 +2,6 @@ from typing import TypedDict, List, Dict, Any, Annotated, Optional
 import operator
 from enum import Enum
 from pydantic import BaseModel, Field
-from langchain_core.documents import Document
 
 class FundingSourceType(str, Enum):
     INSTANT_REBATE = "instant_rebate"
@@ -39,8 +38,11 @@ class AgentState(TypedDict):
     user_profile: Dict[str, Any]
     observations: Annotated[List[str], operator.add]
     search_queries: List[str]
-    documents: List[Document]
+    documents: List[Dict[str, Any]]
+    context_report: Dict[str, Any]
     retry_count: int
+    llm_calls: Annotated[int, operator.add]
+    started_at: float
     final_roadmap: RoadmapOutput | Dict | None
 
 class GradeDocuments(BaseModel):
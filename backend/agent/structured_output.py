@@ -0,0 +1,151 @@
+import os
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+from langchain_core.utils.json import parse_json_markdown
+
+from .state import ComponentRecommendation
+
+# Max LLM calls spent repairing one generation (one per invalid fragment)
+STRUCTURED_REPAIR_BUDGET = int(os.getenv("STRUCTURED_REPAIR_BUDGET", "2"))
+
+REPAIR_PROMPT = """The following JSON object failed validation against the {schema} schema.
+
+Errors:
+{errors}
+
+Object:
+{fragment}
+
+Schema:
+{json_schema}
+
+Fix ONLY the fields with errors, keep every other value unchanged, and return ONLY the corrected JSON object."""
+
+
+def parse_json_reply(text: str) -> Any:
+    """
+    Parse JSON from an LLM reply, with or without ```json fences.
+    Truncated output is closed off where possible; raises ValueError if there is no JSON at all.
+    """
+    try:
+        return parse_json_markdown(text)
+    except Exception as e:
+        raise ValueError(f"No JSON in reply: {e}") from e
+
+
+def validate_fragment(model: Type[BaseModel], fragment: Any) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate one fragment. Returns (clean dict, None) or (None, error summary)."""
+    try:
+        return model.model_validate(fragment).model_dump(mode="json"), None
+    except ValidationError as e:
+        errors = "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or '<root>'}: {err['msg']}"
+            for err in e.errors()
+        )
+        return None, errors
+
+
+class RoadmapDraft:
+    """
+    A roadmap split into recommendations that validate and ones that don't.
+    Valid items are kept as-is (keyed by their position in the LLM output);
+    only the invalid ones are sent back for repair.
+    """
+
+    def __init__(self, data: Any):
+        data = data if isinstance(data, dict) else {}
+        # Fields outside the schema (e.g. a warning the prompt asks for) pass through untouched
+        self.extra = {k: v for k, v in data.items() if k not in ("summary_text", "total_projected_savings_yearly", "recommendations")}
+        self.summary_text = data.get("summary_text") if isinstance(data.get("summary_text"), str) else ""
+        self.total_projected_savings_yearly = data.get("total_projected_savings_yearly")
+        self.valid: Dict[int, Dict] = {}
+        self.invalid: List[Tuple[int, Any, str]] = []
+
+        recommendations = data.get("recommendations")
+        for i, item in enumerate(recommendations if isinstance(recommendations, list) else []):
+            rec, errors = validate_fragment(ComponentRecommendation, item)
+            if rec is not None:
+                self.valid[i] = {**item, **rec}
+            else:
+                self.invalid.append((i, item, errors))
+
+    def to_roadmap(self) -> Optional[Dict]:
+        if not self.valid:
+            return None
+        recommendations = [self.valid[i] for i in sorted(self.valid)]
+        total = self.total_projected_savings_yearly
+        if not isinstance(total, (int, float)):
+            total = sum(r["estimated_monthly_savings"] for r in recommendations) * 12
+        return {
+            **self.extra,
+            "total_projected_savings_yearly": float(total),
+            "recommendations": recommendations,
+            "summary_text": self.summary_text
+        }
+
+
+def _repair_prompt(model: Type[BaseModel], fragment: Any, errors: str) -> str:
+    return REPAIR_PROMPT.format(
+        schema=model.__name__,
+        errors=errors,
+        fragment=json.dumps(fragment, indent=2, default=str),
+        json_schema=json.dumps(model.model_json_schema())
+    )
+
+
+def _check_repair(model: Type[BaseModel], content: Any) -> Optional[Dict]:
+    try:
+        rec, _ = validate_fragment(model, parse_json_reply(str(content)))
+        return rec
+    except ValueError:
+        return None
+
+
+def _report(draft: RoadmapDraft):
+    if draft.invalid:
+        repaired = sum(1 for i, _, _ in draft.invalid if i in draft.valid)
+        print(f"Structured output: repaired {repaired}/{len(draft.invalid)} invalid recommendations")
+
+
+def _repair_limit(budget: int, remaining: Optional[int]) -> int:
+    return budget if remaining is None else max(0, min(budget, remaining))
+
+
+def repair_roadmap(draft: RoadmapDraft, llm, budget: int = STRUCTURED_REPAIR_BUDGET, remaining: Optional[int] = None) -> Tuple[Optional[Dict], int]:
+    """
+    Repair up to `budget` invalid recommendations, one LLM call each, and never
+    more than `remaining` (what is left of the run's LLM call budget).
+    Returns (roadmap, calls made).
+    """
+    calls = 0
+    for index, fragment, errors in draft.invalid[:_repair_limit(budget, remaining)]:
+        calls += 1
+        try:
+            response = llm.invoke(_repair_prompt(ComponentRecommendation, fragment, errors))
+        except Exception as e:
+            print(f"Repair of recommendation {index} failed: {e}")
+            continue
+        rec = _check_repair(ComponentRecommendation, response.content)
+        if rec is not None:
+            draft.valid[index] = {**fragment, **rec} if isinstance(fragment, dict) else rec
+    _report(draft)
+    return draft.to_roadmap(), calls
+
+
+async def arepair_roadmap(draft: RoadmapDraft, llm, budget: int = STRUCTURED_REPAIR_BUDGET, remaining: Optional[int] = None) -> Tuple[Optional[Dict], int]:
+    """Async variant of repair_roadmap."""
+    calls = 0
+    for index, fragment, errors in draft.invalid[:_repair_limit(budget, remaining)]:
+        calls += 1
+        try:
+            response = await llm.ainvoke(_repair_prompt(ComponentRecommendation, fragment, errors))
+        except Exception as e:
+            print(f"Repair of recommendation {index} failed: {e}")
+            continue
+        rec = _check_repair(ComponentRecommendation, response.content)
+        if rec is not None:
+            draft.valid[index] = {**fragment, **rec} if isinstance(fragment, dict) else rec
+    _report(draft)
+    return draft.to_roadmap(), calls
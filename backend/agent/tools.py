@@ -1,102 +1,212 @@
 import os
+import asyncio
 from langchain_openai import OpenAIEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from pinecone import Pinecone
-from tavily import TavilyClient
+from tavily import TavilyClient, AsyncTavilyClient
 from dotenv import load_dotenv
+from typing import Dict, List
+from .utils import run_bounded, arun_bounded
+from .coverage import coverage_index
+from .embedding_cache import with_embedding_cache
+from .search_cache import search_cache
+from .vector_store import get_vector_store
+from .context import make_snippet
+from .llm_gateway import LLMGateway
 
 load_dotenv()
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("hack-earth")
+# Pinecone by default; VECTOR_STORE=local serves queries from the in-process NumPy index
+index = get_vector_store()
 
-embeddings = OpenAIEmbeddings(
+# Only search queries go through here, so case/whitespace variants can share a cache entry
+embeddings = with_embedding_cache(OpenAIEmbeddings(
     model="text-embedding-3-small",
     openai_api_key=os.getenv("OPENAI_API_KEY")
-)
+), normalize=True)
 
-llm = ChatGoogleGenerativeAI(
+# Every LLM call goes through the gateway: per-model rate limits, in-flight caps and 429 retries.
+# The SDK's own retries are turned off (max_retries=1 is a single attempt) so they don't stack with the gateway's.
+llm = LLMGateway(ChatGoogleGenerativeAI(
     model="gemini-2.5-flash-preview-09-2025",
     temperature=0,
+    max_retries=1,
     google_api_key=os.getenv("GOOGLE_API_KEY")
-)
+), model="gemini-2.5-flash-preview-09-2025")
 
-llm_flash_lite = ChatGoogleGenerativeAI(
+llm_flash_lite = LLMGateway(ChatGoogleGenerativeAI(
     model="gemini-2.0-flash-lite",
     temperature=0,
+    max_retries=1,
     google_api_key=os.getenv("GOOGLE_API_KEY")
-)
+), model="gemini-2.0-flash-lite")
 
 tavily = TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+async_tavily = AsyncTavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
 
-def retrieve_context(query: str, filters=None, k=5) -> str:
+def _match_snippets(results) -> List[Dict]:
+    return [
+        make_snippet(
+            match.metadata.get('text'),
+            origin="rag",
+            score=match.score,
+            id=match.id,
+            source=match.metadata.get('source'),
+            type=match.metadata.get('type'),
+            url=match.metadata.get('url')
+        )
+        for match in results['matches']
+    ]
+
+def _web_snippets(response) -> List[Dict]:
+    return [
+        make_snippet(result['content'], origin="web", score=result.get('score', 0.0), url=result['url'])
+        for result in response.get('results', [])
+    ]
+
+COVERAGE_FILTER_TYPE = "utility_rebate"
+
+def _query_index(vector: List[float], k: int, filters=None, include_metadata=True):
+    return index.query(
+        vector=vector,
+        top_k=k,
+        include_metadata=include_metadata,
+        filter=filters
+    )
+
+def retrieve_contexts(queries: List[str], filters=None, k=5) -> List[List[Dict]]:
     """
-    Retrieve relevant documents from Pinecone.
+    Batched retrieval: embed every query with a single embed_documents call,
+    then run the vector store lookups concurrently.
+    Returns the matching snippets for each query, in query order ([] on failure).
     """
+    if not queries:
+        return []
     try:
-        # Embed the query
-        query_embedding = embeddings.embed_query(query)
-        
-        # Query Pinecone
-        results = index.query(
-            vector=query_embedding,
-            top_k=k,
-            include_metadata=True,
-            filter=filters
-        )
-        
-        contexts = []
-        for match in results['matches']:
-            contexts.append(f"""
-Source: {match.metadata.get('source')}
-Type: {match.metadata.get('type')}
-URL: {match.metadata.get('url', 'N/A')}
-Content: {match.metadata.get('text')}
-
-            """)
-        
-        return "\n\n".join(contexts)
+        vectors = embeddings.embed_documents(queries)
+    except Exception as e:
+        print(f"Retrieval Error: {e}")
+        return [[] for _ in queries]
+    
+    results = run_bounded([
+        lambda v=v: _query_index(v, k, filters)
+        for v in vectors
+    ])
+    return [_match_snippets(r) if r else [] for r in results]
+
+async def aretrieve_contexts(queries: List[str], filters=None, k=5) -> List[List[Dict]]:
+    """
+    Async variant of retrieve_contexts.
+    Vector store clients are sync-only, so each query runs in a worker thread.
+    """
+    if not queries:
+        return []
+    try:
+        vectors = await embeddings.aembed_documents(queries)
     except Exception as e:
         print(f"Retrieval Error: {e}")
-        return ""
+        return [[] for _ in queries]
+    
+    results = await arun_bounded([
+        lambda v=v: asyncio.to_thread(_query_index, v, k, filters)
+        for v in vectors
+    ])
+    return [_match_snippets(r) if r else [] for r in results]
+
+def retrieve_context(query: str, filters=None, k=5) -> List[Dict]:
+    """
+    Retrieve relevant documents from the vector store.
+    """
+    return retrieve_contexts([query], filters=filters, k=k)[0]
+
+async def aretrieve_context(query: str, filters=None, k=5) -> List[Dict]:
+    """
+    Async variant of retrieve_context.
+    """
+    return (await aretrieve_contexts([query], filters=filters, k=k))[0]
+
+def _coverage_filter(zip_code: str) -> dict:
+    return {
+        "zip_codes": {"$in": [zip_code]},
+        "type": COVERAGE_FILTER_TYPE
+    }
+
+def _log_coverage(zip_code: str, has_coverage: bool):
+    print(f"Zip Coverage Check ({zip_code}): {'✅ Found' if has_coverage else '❌ Not Found'}")
 
 def check_zip_coverage(zip_code: str) -> bool:
     """
-    Check if we have local utility data for this zip code in Pinecone.
+    Check if we have local utility data for this zip code.
+    Answered from the in-memory coverage index; the Pinecone probe is only
+    used when no index has been built by scripts/embed.py yet.
     """
+    covered = coverage_index.lookup(zip_code, COVERAGE_FILTER_TYPE)
+    if covered is not None:
+        _log_coverage(zip_code, covered)
+        return covered
+    
     try:
-        dummy_vec = embeddings.embed_query("utility rebate")
+        dummy_vec = embeddings.embed_documents(["utility rebate"])[0]
+        results = _query_index(dummy_vec, 1, _coverage_filter(zip_code), include_metadata=False)
         
-        results = index.query(
-            vector=dummy_vec,
-            top_k=1,
-            include_metadata=False,
-            filter={
-                "zip_codes": {"$in": [zip_code]},
-                "type": "utility_rebate"
-            }
+        has_coverage = len(results['matches']) > 0
+        _log_coverage(zip_code, has_coverage)
+        return has_coverage
+    except Exception as e:
+        print(f"Coverage Check Error: {e}")
+        return False
+
+async def acheck_zip_coverage(zip_code: str) -> bool:
+    """
+    Async variant of check_zip_coverage.
+    """
+    covered = coverage_index.lookup(zip_code, COVERAGE_FILTER_TYPE)
+    if covered is not None:
+        _log_coverage(zip_code, covered)
+        return covered
+    
+    try:
+        dummy_vec = (await embeddings.aembed_documents(["utility rebate"]))[0]
+        results = await asyncio.to_thread(
+            _query_index, dummy_vec, 1, _coverage_filter(zip_code), False
         )
         
         has_coverage = len(results['matches']) > 0
-        print(f"Zip Coverage Check ({zip_code}): {'✅ Found' if has_coverage else '❌ Not Found'}")
+        _log_coverage(zip_code, has_coverage)
         return has_coverage
     except Exception as e:
         print(f"Coverage Check Error: {e}")
         return False
 
-def search_web(query: str) -> str:
+def _tavily_search(query: str) -> List[Dict]:
+    print(f"🌍 Searching web for: {query}")
+    response = tavily.search(query=query, search_depth="advanced")
+    return _web_snippets(response)
+
+async def _atavily_search(query: str) -> List[Dict]:
+    print(f"🌍 Searching web for: {query}")
+    response = await async_tavily.search(query=query, search_depth="advanced")
+    return _web_snippets(response)
+
+def search_web(query: str) -> List[Dict]:
     """
     Search the web using Tavily.
+    Results are cached per normalized query and identical in-flight searches are coalesced.
+    """
+    try:
+        return search_cache.get_or_fetch(query, _tavily_search)
+    except Exception as e:
+        print(f"Tavily search failed: {e}")
+        return []
+
+async def asearch_web(query: str) -> List[Dict]:
+    """
+    Async variant of search_web.
     """
-    print(f"🌍 Searching web for: {query}")
     try:
-        response = tavily.search(query=query, search_depth="advanced")
-        context = []
-        for result in response.get('results', [])[:3]:
-            context.append(f"Source: {result['url']}\nContent: {result['content']}")
-        return "\n\n".join(context)
+        return await search_cache.aget_or_fetch(query, _atavily_search)
     except Exception as e:
         print(f"Tavily search failed: {e}")
+        return []
 
 def calculate_co2_impact(item_name: str, monthly_savings: float) -> float:
     """
@@ -1,38 +1,66 @@
-from typing import Dict, Any
+import os
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Callable, Awaitable
 
-def calculate_roi(
-    upfront_cost: float,
-    rebate_amount: float,
-    federal_credit: float,
-    monthly_savings: float
-) -> Dict[str, Any]:
+# Fan-out limits for per-query retrieval (Pinecone / Tavily round trips)
+RETRIEVAL_CONCURRENCY = int(os.getenv("RETRIEVAL_CONCURRENCY", "4"))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "20"))
+
+def run_bounded(
+    calls: List[Callable[[], Any]],
+    limit: int = RETRIEVAL_CONCURRENCY,
+    timeout: float = RETRIEVAL_TIMEOUT_SECONDS,
+    default: Any = None
+) -> List[Any]:
+    """
+    Run zero-arg callables on a thread pool of at most `limit` workers.
+    
+    Results come back in the same order as `calls`. A call that raises or
+    misses its deadline yields `default` instead of failing the whole batch.
     """
-    Calculate ROI metrics for an energy upgrade.
+    if not calls:
+        return []
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, min(limit, len(calls))))
+    futures = [executor.submit(call) for call in calls]
     
-    Args:
-        upfront_cost: Total cost before incentives
-        rebate_amount: Local/State rebates
-        federal_credit: Federal tax credits
-        monthly_savings: Estimated reduction in utility bill
+    # Calls beyond the concurrency cap queue behind earlier ones, so the
+    # batch deadline allows one timeout per "wave" of workers.
+    waves = math.ceil(len(calls) / max(1, limit))
+    deadline = time.monotonic() + timeout * waves
     
-    Returns:
-        Dict with net_cost, annual_savings, roi_years, ten_year_savings
+    results = []
+    for i, future in enumerate(futures):
+        try:
+            results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+        except Exception as e:
+            print(f"Fan-out call {i} failed: {e!r}")
+            results.append(default)
+    
+    executor.shutdown(wait=False, cancel_futures=True)
+    return results
+
+async def arun_bounded(
+    calls: List[Callable[[], Awaitable[Any]]],
+    limit: int = RETRIEVAL_CONCURRENCY,
+    timeout: float = RETRIEVAL_TIMEOUT_SECONDS,
+    default: Any = None
+) -> List[Any]:
+    """
+    Async variant of run_bounded: at most `limit` coroutines in flight,
+    each one individually capped at `timeout` seconds.
     """
-    net_cost = max(0, upfront_cost - rebate_amount - federal_credit)
-    annual_savings = monthly_savings * 12
+    semaphore = asyncio.Semaphore(max(1, limit))
     
-    if annual_savings > 0:
-        roi_years = round(net_cost / annual_savings, 1)
-    else:
-        roi_years = 999.0  # Infinite/Undefined
-        
-    ten_year_savings = (annual_savings * 10) - net_cost
+    async def _run(i: int, call):
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(call(), timeout=timeout)
+            except Exception as e:
+                print(f"Fan-out call {i} failed: {e!r}")
+                return default
     
-    return {
-        "net_cost": net_cost,
-        "amount_saved_per_year": annual_savings,
-        "roi_years": roi_years,
-        "ten_year_savings": ten_year_savings,
-        "initial_cost": upfront_cost,
-        "total_incentives": rebate_amount + federal_credit
-    }
+    return await asyncio.gather(*[_run(i, call) for i, call in enumerate(calls)])
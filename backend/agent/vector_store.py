@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# "pinecone" (default) or "local" for the embedded NumPy index
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone").lower()
+VECTOR_STORE_PATH = os.getenv(
+    "VECTOR_STORE_PATH",
+    str(Path(__file__).parent.parent / "data" / "vector_store")
+)
+INDEX_NAME = "hack-earth"
+EMBEDDING_DIMENSION = 1536  # text-embedding-3-small
+# How often the server checks whether ingestion wrote a newer local index
+VECTOR_STORE_REFRESH_SECONDS = float(os.getenv("VECTOR_STORE_REFRESH_SECONDS", "5"))
+
+
+class VectorMatch:
+    """A query hit, shaped like Pinecone's ScoredVector (id, score, metadata)."""
+
+    __slots__ = ("id", "score", "metadata")
+
+    def __init__(self, id: str, score: float, metadata: Optional[Dict] = None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f"VectorMatch(id={self.id!r}, score={self.score:.4f})"
+
+
+class VectorStore(ABC):
+    """
+    Minimal vector index interface shared by the agent tools and scripts/embed.py.
+    query() returns {"matches": [...]} where each match has .id, .score and .metadata.
+    """
+
+    @abstractmethod
+    def query(self, vector: List[float], top_k: int, filter: Optional[Dict] = None, include_metadata: bool = True) -> Dict:
+        ...
+
+    @abstractmethod
+    def upsert(self, vectors: List[Dict]):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        ...
+
+    @abstractmethod
+    def list_ids(self) -> Iterator[str]:
+        """Every vector ID in the index."""
+
+    def flush(self):
+        """Persist buffered writes. Backends that write through (Pinecone) have nothing to do."""
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index_name: str = INDEX_NAME, api_key: Optional[str] = None, create: bool = False):
+        from pinecone import Pinecone
+
+        self.pc = Pinecone(api_key=api_key or os.getenv("PINECONE_API_KEY"))
+        if create and index_name not in [index.name for index in self.pc.list_indexes()]:
+            print(f"Creating index {index_name}...")
+            self.pc.create_index(
+                name=index_name,
+                dimension=EMBEDDING_DIMENSION,
+                metric="cosine",
+                spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}
+            )
+        self.index = self.pc.Index(index_name)
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+    def upsert(self, vectors):
+        self.index.upsert(vectors=vectors)
+
+    def delete(self, ids):
+        self.index.delete(ids=ids)
+
+    def list_ids(self):
+        # Paginated ID listing; only available on serverless indexes
+        for page in self.index.list():
+            yield from page
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process index: unit-normalized float32 vectors in a memory-mapped .npy
+    file plus a JSON metadata table. Queries are a single matrix-vector
+    product over the rows that survive the metadata filter.
+
+    Writes are buffered in memory and written to disk once by flush(). Other
+    processes (the API server) pick up a flushed index on their next query,
+    checking the files at most every VECTOR_STORE_REFRESH_SECONDS.
+
+    Supported filters are the ones the agent uses: equality on a field
+    (`{"location": "federal"}` or `{"$eq": ...}`) and `{"$in": [...]}`, where
+    list-valued fields such as `zip_codes` match if any element matches.
+    """
+
+    def __init__(self, path: str = VECTOR_STORE_PATH, dimension: int = EMBEDDING_DIMENSION, refresh_seconds: float = VECTOR_STORE_REFRESH_SECONDS):
+        self.path = Path(path)
+        self.dimension = dimension
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._load()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.path / "vectors.npy"
+
+    @property
+    def _metadata_path(self) -> Path:
+        return self.path / "metadata.json"
+
+    def _file_mtime(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._metadata_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        mtime = self._file_mtime()
+        matrix = np.zeros((0, self.dimension), dtype=np.float32)
+        rows = []
+        if mtime is not None and self._vectors_path.exists():
+            loaded = np.load(self._vectors_path, mmap_mode="r")
+            with open(self._metadata_path) as f:
+                loaded_rows = json.load(f)
+            # metadata.json is replaced after vectors.npy, so a mismatch means a save is mid-way
+            if len(loaded) == len(loaded_rows):
+                matrix, rows = loaded, loaded_rows
+            else:
+                mtime = None
+        self._matrix = matrix
+        self._ids = [r["id"] for r in rows]
+        self._metadata = [r["metadata"] for r in rows]
+        self._positions = {id_: row for row, id_ in enumerate(self._ids)}
+        self._new_rows: List[np.ndarray] = []
+        self._updated_rows: Dict[int, np.ndarray] = {}
+        self._unsaved = False
+        self._mtime = mtime
+        self._publish()
+
+    def _refresh(self):
+        """Reload if another process flushed a newer index, unless this one holds unsaved writes."""
+        now = time.monotonic()
+        if self._unsaved or now - self._checked_at < self.refresh_seconds:
+            return
+        self._checked_at = now
+        if self._file_mtime() != self._mtime:
+            with self._lock:
+                if not self._unsaved:
+                    self._load()
+
+    def _materialize(self):
+        """Fold buffered upserts into the matrix, in one copy however many batches there were."""
+        if not self._new_rows and not self._updated_rows:
+            return
+        matrix = self._matrix
+        if self._updated_rows:
+            matrix = np.array(matrix, dtype=np.float32)
+            for row, values in self._updated_rows.items():
+                matrix[row] = values
+        if self._new_rows:
+            matrix = np.vstack([matrix, np.stack(self._new_rows)])
+        self._matrix = matrix
+        self._new_rows = []
+        self._updated_rows = {}
+        self._publish()
+
+    def _publish(self):
+        # Readers grab this tuple once, so a concurrent write never shows them a half-built index
+        postings: Dict[str, Dict[Any, List[int]]] = {}
+        for row, meta in enumerate(self._metadata):
+            for field, value in meta.items():
+                values = value if isinstance(value, list) else [value]
+                for v in values:
+                    if isinstance(v, (str, int, float, bool)):
+                        postings.setdefault(field, {}).setdefault(v, []).append(row)
+        self._snapshot = (
+            self._matrix,
+            list(self._ids),
+            list(self._metadata),
+            {f: {v: np.asarray(r, dtype=np.int64) for v, r in vals.items()} for f, vals in postings.items()}
+        )
+
+    def _filter_rows(self, filter: Optional[Dict], postings) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        rows = None
+        for field, condition in filter.items():
+            if isinstance(condition, dict):
+                if "$in" in condition:
+                    wanted = condition["$in"]
+                elif "$eq" in condition:
+                    wanted = [condition["$eq"]]
+                else:
+                    raise ValueError(f"Unsupported filter operator for {field}: {condition}")
+            else:
+                wanted = [condition]
+            field_postings = postings.get(field, {})
+            matched = [field_postings[v] for v in wanted if v in field_postings]
+            field_rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+            rows = field_rows if rows is None else np.intersect1d(rows, field_rows, assume_unique=True)
+        return rows
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        self._refresh()
+        if self._new_rows or self._updated_rows:
+            with self._lock:
+                self._materialize()
+        matrix, ids, metadata, postings = self._snapshot
+        rows = self._filter_rows(filter, postings)
+        candidates = matrix if rows is None else matrix[rows]
+        if len(candidates) == 0 or top_k <= 0:
+            return {"matches": []}
+
+        q = np.array(vector, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        scores = candidates @ q
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        matches = []
+        for i in top:
+            row = int(i) if rows is None else int(rows[i])
+            matches.append(VectorMatch(ids[row], float(scores[i]), metadata[row] if include_metadata else None))
+        return {"matches": matches}
+
+    def upsert(self, vectors):
+        with self._lock:
+            existing_rows = len(self._matrix)
+            for v in vectors:
+                values = np.array(v["values"], dtype=np.float32)
+                values /= np.linalg.norm(values) or 1.0
+                row = self._positions.get(v["id"])
+                if row is None:
+                    self._positions[v["id"]] = len(self._ids)
+                    self._ids.append(v["id"])
+                    self._metadata.append(v.get("metadata", {}))
+                    self._new_rows.append(values)
+                    continue
+                if row < existing_rows:
+                    self._updated_rows[row] = values
+                else:
+                    self._new_rows[row - existing_rows] = values
+                self._metadata[row] = v.get("metadata", {})
+            self._unsaved = True
+
+    def delete(self, ids):
+        drop = set(ids)
+        with self._lock:
+            self._materialize()
+            keep = [row for row, id_ in enumerate(self._ids) if id_ not in drop]
+            if len(keep) == len(self._ids):
+                return
+            self._matrix = np.array(self._matrix[keep], dtype=np.float32).reshape(len(keep), self.dimension)
+            self._ids = [self._ids[row] for row in keep]
+            self._metadata = [self._metadata[row] for row in keep]
+            self._positions = {id_: row for row, id_ in enumerate(self._ids)}
+            self._unsaved = True
+            self._publish()
+
+    def list_ids(self):
+        return iter(list(self._ids))
+
+    def flush(self):
+        """Write buffered upserts and deletes to disk in one pass."""
+        with self._lock:
+            if not self._unsaved:
+                return
+            self._materialize()
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp_vectors = self.path / "vectors.tmp.npy"
+            tmp_metadata = self.path / "metadata.tmp.json"
+            np.save(tmp_vectors, self._matrix)
+            with open(tmp_metadata, "w") as f:
+                json.dump([{"id": i, "metadata": m} for i, m in zip(self._ids, self._metadata)], f)
+            os.replace(tmp_vectors, self._vectors_path)
+            os.replace(tmp_metadata, self._metadata_path)
+            # Reopen memory-mapped so the in-memory copy can be freed
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def get_vector_store(kind: str = VECTOR_STORE, create: bool = False) -> VectorStore:
+    """Pick the backend configured by VECTOR_STORE."""
+    if kind == "local":
+        return LocalVectorStore()
+    return PineconeVectorStore(create=create)
@@ -1,8 +1,17 @@
 import os
+import time
+import json
+import base64
+import hashlib
+import threading
+import jwt
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from fastapi import Header, HTTPException
 from pinecone import Pinecone
+from agent.cache import TTLCache
 
 
 load_dotenv()
@@ -10,6 +19,24 @@ load_dotenv()
 url: str = os.getenv("SUPABASE_URL", "")
 key: str = os.getenv("SUPABASE_KEY", "")
 pinecone_api_key: str = os.getenv("PINECONE_API_KEY", "")
+# Project JWT secret (Settings > API); lets us verify access tokens without calling Supabase Auth
+jwt_secret: str = os.getenv("SUPABASE_JWT_SECRET", "")
+jwt_audience: str = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Dashboard/impact rows only change through save_roadmap / save_impact, which invalidate them;
+# the TTL bounds staleness for writes made elsewhere (other workers, the Supabase console)
+USER_DATA_CACHE_TTL_SECONDS = float(os.getenv("USER_DATA_CACHE_TTL_SECONDS", "30"))
+USER_DATA_CACHE_SIZE = int(os.getenv("USER_DATA_CACHE_SIZE", "10000"))
+# Roadmap retention: newest N rows per user (0 = unlimited), and a max age in days (0 = no limit).
+# The newest roadmap is always kept.
+ROADMAP_HISTORY_KEEP = int(os.getenv("ROADMAP_HISTORY_KEEP", "20"))
+ROADMAP_HISTORY_MAX_AGE_DAYS = int(os.getenv("ROADMAP_HISTORY_MAX_AGE_DAYS", "0"))
+
+# History queries filter on user_id and sort on (created_at, id); they stay index-only with:
+#   create index agent_roadmaps_user_created on agent_roadmaps (user_id, created_at desc, id desc);
+ROADMAP_COLUMNS = "id, user_id, created_at, roadmap_data, summary, total_savings"
+ROADMAP_SUMMARY_COLUMNS = "id, created_at, summary, total_savings"
 
 
 # Initialize Supabase client
@@ -19,17 +46,112 @@ supabase: Client = create_client(url, key)
 pc = Pinecone(api_key=pinecone_api_key)
 
 
+class AuthenticatedUser:
+    """The user behind a locally verified access token. Exposes `.id` like Supabase's User."""
+
+    __slots__ = ("id", "email", "role", "claims")
+
+    def __init__(self, claims: dict):
+        self.id = claims["sub"]
+        self.email = claims.get("email")
+        self.role = claims.get("role")
+        self.claims = claims
+
+
+# Verified users keyed by token hash; entries never outlive the token's own expiry
+_auth_cache = TTLCache(max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL_SECONDS)
+
+
+def _verify_token(token: str) -> Optional[AuthenticatedUser]:
+    """
+    Check the token's HS256 signature and expiry against the project JWT secret.
+    Returns None when local verification can't decide (no secret configured,
+    asymmetric signing keys, unexpected claims) so the caller asks Supabase instead.
+    Raises jwt.InvalidTokenError for tokens that are definitely invalid.
+    """
+    if not jwt_secret:
+        return None
+    try:
+        if jwt.get_unverified_header(token).get("alg") != "HS256":
+            return None
+        claims = jwt.decode(
+            token,
+            jwt_secret,
+            algorithms=["HS256"],
+            audience=jwt_audience,
+            options={"require": ["exp", "sub"]}
+        )
+    except (jwt.ExpiredSignatureError, jwt.InvalidSignatureError, jwt.DecodeError):
+        raise
+    except jwt.InvalidTokenError:
+        return None
+    return AuthenticatedUser(claims)
+
+
+def _token_ttl(token: str) -> float:
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+    except jwt.InvalidTokenError:
+        exp = None
+    if exp is None:
+        return AUTH_CACHE_TTL_SECONDS
+    return min(AUTH_CACHE_TTL_SECONDS, exp - time.time())
+
+
 def get_current_user(authorization: str = Header(...)):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid token format")
     
     token = authorization.split(" ")[1]
+    cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
     
-    try:
-        user = supabase.auth.get_user(token)
+    user = _auth_cache.get(cache_key)
+    if user is not None:
         return user
-    except Exception as e:
+    
+    try:
+        user = _verify_token(token)
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if user is None:
+        # Fall back to asking Supabase Auth
+        try:
+            user = supabase.auth.get_user(token)
+        except Exception as e:
+            raise HTTPException(status_code=401, detail="Invalid token")
+    
+    ttl = _token_ttl(token)
+    if ttl > 0:
+        _auth_cache.set(cache_key, user, ttl=ttl)
+    return user
+
+
+# Latest roadmap / impact row per user, keyed by (table, user_id).
+# Misses are never cached, so a row another worker just wrote shows up on the next read.
+user_data_cache = TTLCache(max_size=USER_DATA_CACHE_SIZE, ttl=USER_DATA_CACHE_TTL_SECONDS)
+# Bumped on every invalidation so a read that started before a write can't cache the old row
+_user_data_generations: dict = {}
+_user_data_lock = threading.Lock()
+
+
+def _user_data_generation(key) -> int:
+    with _user_data_lock:
+        return _user_data_generations.get(key, 0)
+
+
+def _invalidate_user_data(key):
+    with _user_data_lock:
+        _user_data_generations[key] = _user_data_generations.get(key, 0) + 1
+        user_data_cache.pop(key)
+
+
+def _cache_user_data(key, generation: int, row):
+    if row is None:
+        return
+    with _user_data_lock:
+        if _user_data_generations.get(key, 0) == generation:
+            user_data_cache.set(key, row)
 
 
 def save_roadmap(user_id: str, roadmap: dict, summary: str = None, total_savings: float = None):
@@ -41,36 +163,137 @@ def save_roadmap(user_id: str, roadmap: dict, summary: str = None, total_savings
             "total_savings": total_savings
         }
         response = supabase.table("agent_roadmaps").insert(data).execute()
-        return response
+        _invalidate_user_data(("agent_roadmaps", user_id))
     except Exception as e:
         print(f"Error saving roadmap: {e}")
         raise e
+    
+    try:
+        prune_roadmaps(user_id)
+    except Exception as e:
+        # Retention is best effort; the new roadmap is already saved
+        print(f"Error pruning roadmaps: {e}")
+    return response
 
 def get_roadmap(user_id: str):
+    key = ("agent_roadmaps", user_id)
+    cached = user_data_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = _user_data_generation(key)
     try:
         response = supabase.table("agent_roadmaps") \
-            .select("*") \
+            .select(ROADMAP_COLUMNS) \
             .eq("user_id", user_id) \
             .order("created_at", desc=True) \
+            .order("id", desc=True) \
             .limit(1) \
             .execute()
         
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
+        row = response.data[0] if response.data else None
+        _cache_user_data(key, generation, row)
+        return row
     except Exception as e:
         print(f"Error fetching roadmap: {e}")
         return None
 
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: str):
+    created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return created_at, row_id
+
+def list_roadmaps(user_id: str, limit: int = 20, cursor: Optional[str] = None) -> dict:
+    """
+    One page of a user's roadmap history, newest first, without the roadmap JSON.
+    Keyset pagination on (created_at, id): pass the returned `next_cursor` to get
+    the following page; it is None on the last page.
+    """
+    query = supabase.table("agent_roadmaps") \
+        .select(ROADMAP_SUMMARY_COLUMNS) \
+        .eq("user_id", user_id)
+    
+    if cursor:
+        created_at, row_id = _decode_cursor(cursor)
+        query = query.or_(
+            f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{row_id}")'
+        )
+    
+    response = query \
+        .order("created_at", desc=True) \
+        .order("id", desc=True) \
+        .limit(limit + 1) \
+        .execute()
+    
+    rows = response.data or []
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+def get_roadmap_by_id(user_id: str, roadmap_id: str):
+    try:
+        response = supabase.table("agent_roadmaps") \
+            .select(ROADMAP_COLUMNS) \
+            .eq("user_id", user_id) \
+            .eq("id", roadmap_id) \
+            .limit(1) \
+            .execute()
+        
+        return response.data[0] if response.data else None
+    except Exception as e:
+        print(f"Error fetching roadmap {roadmap_id}: {e}")
+        return None
+
+def prune_roadmaps(user_id: str) -> int:
+    """Apply the retention policy to one user's roadmaps. Returns the number of rows deleted."""
+    if ROADMAP_HISTORY_KEEP <= 0 and ROADMAP_HISTORY_MAX_AGE_DAYS <= 0:
+        return 0
+    
+    # Only ids and timestamps; rows beyond the retention window are few since we prune on every save
+    response = supabase.table("agent_roadmaps") \
+        .select("id, created_at") \
+        .eq("user_id", user_id) \
+        .order("created_at", desc=True) \
+        .order("id", desc=True) \
+        .execute()
+    rows = response.data or []
+    
+    expired = []
+    cutoff = None
+    if ROADMAP_HISTORY_MAX_AGE_DAYS > 0:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=ROADMAP_HISTORY_MAX_AGE_DAYS)
+    for position, row in enumerate(rows[1:], start=1):
+        if ROADMAP_HISTORY_KEEP > 0 and position >= ROADMAP_HISTORY_KEEP:
+            expired.append(row["id"])
+        elif cutoff and datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")) < cutoff:
+            expired.append(row["id"])
+    
+    for i in range(0, len(expired), 100):
+        supabase.table("agent_roadmaps") \
+            .delete() \
+            .eq("user_id", user_id) \
+            .in_("id", expired[i:i + 100]) \
+            .execute()
+    if expired:
+        print(f"Pruned {len(expired)} old roadmaps for user {user_id}")
+    return len(expired)
+
 def save_impact(impact_data: dict):
     try:
         response = supabase.table("user_impact").upsert(impact_data).execute()
+        _invalidate_user_data(("user_impact", impact_data.get("user_id")))
         return response
     except Exception as e:
         print(f"Error saving impact: {e}")
         raise e
 
 def get_impact(user_id: str):
+    key = ("user_impact", user_id)
+    cached = user_data_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = _user_data_generation(key)
     try:
         response = supabase.table("user_impact") \
             .select("*") \
@@ -78,9 +301,9 @@ def get_impact(user_id: str):
             .limit(1) \
             .execute()
         
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
+        row = response.data[0] if response.data else None
+        _cache_user_data(key, generation, row)
+        return row
     except Exception as e:
         print(f"Error fetching impact: {e}")
         return None
@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+JOB_STORE = os.getenv("JOB_STORE", "memory").lower()
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", str(Path(__file__).parent / "data" / "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+# Roadmaps generated inline over SSE (/roadmap/stream) at once; beyond this the endpoint returns 429
+STREAM_MAX_CONCURRENT = int(os.getenv("STREAM_MAX_CONCURRENT", str(JOB_WORKERS)))
+# Finished jobs (and their results) are kept this long for polling, up to JOB_HISTORY_MAX of them
+JOB_RESULT_TTL_SECONDS = float(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+JOB_HISTORY_MAX = int(os.getenv("JOB_HISTORY_MAX", "1000"))
+# A "running" SQLite job older than this is assumed to belong to a dead worker and is re-queued.
+# Must be longer than any real agent run.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "900"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised by enqueue() when the backlog is at JOB_QUEUE_MAX."""
+
+
+class JobBackend(ABC):
+    """
+    Queue + status store for background jobs.
+    A job is a dict with id, user_id, payload, status, result, error and timestamps.
+    """
+
+    @abstractmethod
+    async def enqueue(self, user_id: str, payload: Dict) -> Dict:
+        ...
+
+    @abstractmethod
+    async def dequeue(self) -> Dict:
+        """Wait for the oldest queued job and mark it running."""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    async def finish(self, job_id: str, result: Any = None, error: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    def queued_count(self) -> int:
+        ...
+
+
+def _new_job(user_id: str, payload: Dict) -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "payload": payload,
+        "status": QUEUED,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None
+    }
+
+
+class InMemoryJobBackend(JobBackend):
+    """
+    Single-process backend; jobs are lost on restart.
+    Finished jobs are evicted after JOB_RESULT_TTL_SECONDS, oldest first once
+    more than JOB_HISTORY_MAX are held.
+    """
+
+    def __init__(self, max_queued: int = JOB_QUEUE_MAX, result_ttl: float = JOB_RESULT_TTL_SECONDS, max_finished: int = JOB_HISTORY_MAX):
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Dict] = {}
+        # Finished job IDs in the order they finished
+        self._finished: Deque[str] = deque()
+        self._queue: Optional[asyncio.Queue] = None
+        # get() runs on threadpool threads (sync endpoint) while finish() runs on the event loop
+        self._lock = threading.Lock()
+
+    def _get_queue(self) -> asyncio.Queue:
+        # Created lazily so it binds to the server's running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def _prune(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.result_ttl
+        while self._finished:
+            job = self._jobs.get(self._finished[0])
+            if job is not None and len(self._finished) <= self.max_finished and job["finished_at"] > cutoff:
+                break
+            self._jobs.pop(self._finished.popleft(), None)
+
+    async def enqueue(self, user_id: str, payload: Dict) -> Dict:
+        if self.queued_count() >= self.max_queued:
+            raise QueueFull()
+        job = _new_job(user_id, payload)
+        with self._lock:
+            self._jobs[job["id"]] = job
+        self._get_queue().put_nowait(job["id"])
+        return dict(job)
+
+    async def dequeue(self) -> Dict:
+        job_id = await self._get_queue().get()
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = RUNNING
+            job["started_at"] = time.time()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    async def finish(self, job_id: str, result: Any = None, error: Optional[str] = None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = FAILED if error else DONE
+            job["result"] = result
+            job["error"] = error
+            job["finished_at"] = time.time()
+            self._finished.append(job_id)
+            self._prune()
+
+    def queued_count(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+
+class SQLiteJobBackend(JobBackend):
+    """
+    Durable backend backed by a local SQLite file, shareable by several worker processes.
+    Blocking SQLite calls run in a thread so they never stall the event loop.
+    A job left "running" for longer than JOB_LEASE_SECONDS (e.g. by a crashed
+    process) is re-queued; jobs live workers are still running are left alone.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH, max_queued: int = JOB_QUEUE_MAX, poll_interval: float = 2.0,
+                 lease_seconds: float = JOB_LEASE_SECONDS, result_ttl: float = JOB_RESULT_TTL_SECONDS):
+        self.max_queued = max_queued
+        # Only jobs enqueued by other processes wait for a poll; local ones wake a worker immediately
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                payload TEXT,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        self._conn.commit()
+
+    def _get_wakeup(self) -> asyncio.Event:
+        # Created lazily so it binds to the server's running event loop
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _row_to_job(self, row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"]) if job["payload"] else None
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def _insert(self, job: Dict):
+        with self._lock:
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull()
+            self._conn.execute(
+                "INSERT INTO jobs (id, user_id, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job["id"], job["user_id"], json.dumps(job["payload"]), QUEUED, job["created_at"])
+            )
+            self._conn.commit()
+
+    async def enqueue(self, user_id: str, payload: Dict) -> Dict:
+        job = _new_job(user_id, payload)
+        await asyncio.to_thread(self._insert, job)
+        self._get_wakeup().set()
+        return job
+
+    def _claim(self) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            expired = self._conn.execute(
+                "UPDATE jobs SET status = ?, started_at = NULL WHERE status = ? AND started_at < ?",
+                (QUEUED, RUNNING, now - self.lease_seconds)
+            ).rowcount
+            if expired:
+                print(f"Re-queued {expired} jobs whose lease expired")
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            claimed = row is not None and self._conn.execute(
+                # Guarded on status so two processes can't claim the same row
+                "UPDATE jobs SET status = ?, started_at = ? WHERE id = ? AND status = ?", (RUNNING, now, row["id"], QUEUED)
+            ).rowcount == 1
+            self._conn.commit()
+        if not claimed:
+            return None
+        job = self._row_to_job(row)
+        job["status"] = RUNNING
+        job["started_at"] = now
+        return job
+
+    async def dequeue(self) -> Dict:
+        wakeup = self._get_wakeup()
+        while True:
+            wakeup.clear()
+            job = await asyncio.to_thread(self._claim)
+            if job:
+                return job
+            try:
+                await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def _finish(self, job_id: str, result: Any, error: Optional[str]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error else DONE, json.dumps(result) if result is not None else None, error, now, job_id)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, now - self.result_ttl)
+            )
+            self._conn.commit()
+
+    async def finish(self, job_id: str, result: Any = None, error: Optional[str] = None):
+        await asyncio.to_thread(self._finish, job_id, result, error)
+
+    def queued_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+
+def create_job_backend(kind: str = JOB_STORE) -> JobBackend:
+    if kind == "sqlite":
+        return SQLiteJobBackend()
+    return InMemoryJobBackend()
+
+
+class JobWorkerPool:
+    """
+    A fixed number of asyncio workers pulling from a JobBackend.
+    The worker count caps how many jobs run at once; everything else waits
+    in the backend queue, which refuses new work once it is full.
+    """
+
+    def __init__(self, backend: JobBackend, handler: Callable[[Dict], Awaitable[Any]], workers: int = JOB_WORKERS):
+        self.backend = backend
+        self.handler = handler
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = await self.backend.dequeue()
+            print(f"Worker {worker_id} running job {job['id']}")
+            try:
+                result = await self.handler(job)
+                await self.backend.finish(job["id"], result=result)
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                await self.backend.finish(job["id"], error=str(e))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "queued": self.backend.queued_count()}
+
+
+class ConcurrencyLimit:
+    """
+    Non-blocking cap for work that can't go through the job queue, such as
+    SSE generations that must run inside their request. acquire() returns
+    a release callback (safe to call more than once) or None when full.
+    """
+
+    def __init__(self, limit: int = STREAM_MAX_CONCURRENT):
+        self.limit = limit
+        self.active = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[Callable[[], None]]:
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return None
+            self.active += 1
+
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if not released:
+                    released = True
+                    self.active -= 1
+
+        return release
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "active": self.active, "rejected": self.rejected}
@@ -1,11 +1,17 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-from db import supabase, get_current_user
-from models import UserCredentials, UserSurveyInput
+from db import supabase, get_current_user, user_data_cache
+from models import UserCredentials, UserSurveyInput, RoadmapHistory
 from fastapi import FastAPI, Depends, HTTPException
-from langchain_google_genai import ChatGoogleGenerativeAI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from fastapi.encoders import jsonable_encoder
 import json
 import os
+import asyncio
+import time
+import hashlib
 
 
 app = FastAPI()
@@ -72,85 +78,362 @@ def save_survey(survey: UserSurveyInput, user = Depends(get_current_user)):
         raise HTTPException(status_code=400, detail=str(e))
 
 from agent.graph import app as agent_app
+from agent.coverage import coverage_index
+from jobs import create_job_backend, JobWorkerPool, QueueFull, ConcurrencyLimit
+from agent.roadmap_cache import roadmap_cache, canonical_profile, personalize_roadmap, personalize_recommendation
+from agent.finance import apply_financials
+
+@app.on_event("startup")
+def load_coverage_index():
+    if not coverage_index.load():
+        print("No zip coverage index found, coverage checks will query Pinecone")
+
+
+def initial_agent_state(profile: dict) -> dict:
+    return {
+        "user_profile": profile,
+        "observations": [],
+        "search_queries": [],
+        "documents": [],
+        "retry_count": 0,
+        "llm_calls": 0,
+        "started_at": time.time(),
+        "final_roadmap": None
+    }
+
+
+def keep_recommendation(rec: dict) -> bool:
+    """Drop items with no savings or a >30 year payback."""
+    try:
+        roi = rec.get("roi_years")
+        monthly_savings = rec.get("estimated_monthly_savings", 0)
+        
+        if roi is not None and (isinstance(roi, (int, float)) and roi > 30):
+            return False
+            
+        if monthly_savings <= 0:
+            return False
+            
+        return True
+    except Exception as e:
+        print(f"Error filtering item {rec.get('name')}: {e}")
+        return False
 
-@app.post('/roadmap')
-def generate_roadmap_endpoint(survey: UserSurveyInput, user = Depends(get_current_user)):
+
+def filter_recommendations(roadmap: dict, survey_data: dict) -> dict:
     """
-    Trigger the AI Agent to generate a roadmap based on survey data.
+    Apply keep_recommendation to every item and recompute the yearly total.
+    Dropped items free up shared credit caps, so the financials are recomputed too.
     """
-    try:
-        # User extraction logic
-        if isinstance(user, tuple):
-            user_obj = user[0]
-        else:
-            user_obj = user
-
-        if hasattr(user_obj, "user") and user_obj.user:
-            user_id = user_obj.user.id
-        elif hasattr(user_obj, "id"):
-             user_id = user_obj.id
-        else:
-            raise HTTPException(status_code=400, detail=f"Could not extract user ID from {type(user_obj)}")
-        
-        print(f"Starting Agent for {survey.zip_code}...")
-        
-        # Initialize state
-        initial_state = {
-            "user_profile": survey.model_dump(),
-            "observations": [],
-            "search_queries": [],
-            "documents": [],
-            "retry_count": 0,
-            "final_roadmap": None
-        }
+    filtered_recommendations = [rec for rec in roadmap.get("recommendations", []) if keep_recommendation(rec)]
+    roadmap["recommendations"] = filtered_recommendations
+    apply_financials(roadmap, survey_data)
+    
+    new_total_yearly = sum(r.get("estimated_monthly_savings", 0) * 12 for r in filtered_recommendations)
+    roadmap["total_projected_savings_yearly"] = new_total_yearly
+    return roadmap
+
+
+async def save_user_roadmap(user_id: str, roadmap: dict):
+    from db import save_roadmap
+    # Extract summary and savings for easier querying
+    summary_text = roadmap.get("summary_text", "")
+    total_savings = roadmap.get("total_projected_savings_yearly", 0)
+    
+    await run_in_threadpool(save_roadmap, user_id, roadmap, summary_text, total_savings)
+    print(f"Roadmap saved for user {user_id}")
+
+
+async def run_roadmap(survey_data: dict, user_id: str):
+    """
+    Run (or reuse from roadmap_cache) the agent for one survey, then
+    personalize, filter and save the roadmap for this user.
+    """
+    profile = canonical_profile(survey_data)
+    roadmap = roadmap_cache.get(profile)
+    
+    if roadmap:
+        print(f"Roadmap cache hit for {profile.get('zip_code')}")
+    else:
+        print(f"Starting Agent for {profile.get('zip_code')}...")
         
         # Run Graph
-        result = agent_app.invoke(initial_state)
+        result = await agent_app.ainvoke(initial_agent_state(profile))
         roadmap = result.get("final_roadmap")
-        
         if roadmap:
-            recommendations = roadmap.get("recommendations", [])
-            filtered_recommendations = []
-            
-            for rec in recommendations:
+            roadmap_cache.set(profile, roadmap)
+    
+    if roadmap:
+        roadmap = filter_recommendations(personalize_roadmap(roadmap, survey_data), survey_data)
+        await save_user_roadmap(user_id, roadmap)
+    
+    return roadmap
+
+
+async def run_roadmap_job(job: dict):
+    roadmap = await run_roadmap(job["payload"], job["user_id"])
+    if not roadmap:
+        raise RuntimeError("Roadmap generation failed")
+    return roadmap
+
+
+job_backend = create_job_backend()
+roadmap_workers = JobWorkerPool(job_backend, run_roadmap_job)
+# /roadmap/stream runs the agent in the request, so it gets its own cap instead of the queue
+roadmap_streams = ConcurrencyLimit()
+
+@app.on_event("startup")
+async def start_roadmap_workers():
+    roadmap_workers.start()
+
+@app.on_event("shutdown")
+async def stop_roadmap_workers():
+    await roadmap_workers.stop()
+
+
+@app.post('/roadmap', status_code=202)
+async def generate_roadmap_endpoint(survey: UserSurveyInput, user = Depends(get_current_user)):
+    """
+    Queue a roadmap generation job for this survey and return its id.
+    A bounded worker pool runs the agent; poll /roadmap/jobs/{job_id} for the result.
+    """
+    # User extraction logic
+    if isinstance(user, tuple):
+        user_obj = user[0]
+    else:
+        user_obj = user
+
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    elif hasattr(user_obj, "id"):
+         user_id = user_obj.id
+    else:
+        raise HTTPException(status_code=400, detail=f"Could not extract user ID from {type(user_obj)}")
+    
+    try:
+        job = await job_backend.enqueue(user_id, survey.model_dump())
+    except QueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many roadmaps are being generated right now. Please retry shortly.",
+            headers={"Retry-After": "30"}
+        )
+    
+    print(f"Queued roadmap job {job['id']} for {survey.zip_code}")
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+@app.get('/roadmap/jobs/{job_id}')
+def get_roadmap_job(job_id: str, user = Depends(get_current_user)):
+    # User extraction logic (reused)
+    if isinstance(user, tuple):
+        user_obj = user[0]
+    else:
+        user_obj = user
+
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    elif hasattr(user_obj, "id"):
+         user_id = user_obj.id
+    else:
+        raise HTTPException(status_code=400, detail=f"Could not extract user ID")
+    
+    job = job_backend.get(job_id)
+    if not job or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"]
+    }
+
+
+
+AGENT_NODES = {"analyze", "retrieve_local", "retrieve_hybrid", "grade", "rewrite", "generate"}
+SSE_KEEPALIVE_SECONDS = 15
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_roadmap_events(survey: UserSurveyInput, user_id: str):
+    """
+    Yield SSE messages for one roadmap run: node transitions, each
+    recommendation as soon as it is parsed, then the final saved roadmap.
+    Comment lines are sent while waiting so proxies keep the connection open.
+    
+    Recommendations streamed during generation carry "provisional": true:
+    their incentive and ROI figures are for the item alone, and the "done"
+    roadmap shares credit caps across the items that survive filtering.
+    """
+    survey_data = survey.model_dump()
+    profile = canonical_profile(survey_data)
+    yield sse_event("status", {"stage": "started"})
+    
+    roadmap = roadmap_cache.get(profile)
+    if roadmap:
+        yield sse_event("status", {"stage": "cache_hit"})
+        # The final figures are known up front, so stream exactly what "done" will hold
+        roadmap = filter_recommendations(personalize_roadmap(roadmap, survey_data), survey_data)
+        for rec in roadmap.get("recommendations", []):
+            yield sse_event("recommendation", {**rec, "provisional": False})
+    else:
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def run_agent():
+            try:
+                async for event in agent_app.astream_events(initial_agent_state(profile), version="v2"):
+                    await queue.put(event)
+            except Exception as e:
+                await queue.put(e)
+            finally:
+                await queue.put(None)
+        
+        task = asyncio.create_task(run_agent())
+        active_nodes = set()
+        final_state = None
+        try:
+            while True:
                 try:
-                    roi = rec.get("roi_years")
-                    monthly_savings = rec.get("estimated_monthly_savings", 0)
-                    
-                    if roi is not None and (isinstance(roi, (int, float)) and roi > 30):
-                        continue
-                        
-                    if monthly_savings <= 0:
-                        continue
-                        
-                    filtered_recommendations.append(rec)
-                except Exception as e:
-                    print(f"Error filtering item {rec.get('name')}: {e}")
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
                     continue
-            
-            roadmap["recommendations"] = filtered_recommendations
-            
-            new_total_yearly = sum(r.get("estimated_monthly_savings", 0) * 12 for r in filtered_recommendations)
-            roadmap["total_projected_savings_yearly"] = new_total_yearly
-            
-
-            from db import save_roadmap
-            # Extract summary and savings for easier querying
-            summary_text = roadmap.get("summary_text", "")
-            total_savings = roadmap.get("total_projected_savings_yearly", 0)
-            
-            save_roadmap(user_id, roadmap, summary_text, total_savings)
-            print(f"Roadmap saved for user {user_id}")
+                
+                if event is None:
+                    break
+                if isinstance(event, Exception):
+                    raise event
+                
+                kind, name = event["event"], event.get("name")
+                # A node shows up as both the graph wrapper and our RunnableLambda; report it once
+                if kind == "on_chain_start" and name in AGENT_NODES and name not in active_nodes:
+                    active_nodes.add(name)
+                    yield sse_event("node", {"node": name, "status": "started"})
+                elif kind == "on_chain_end" and name in AGENT_NODES and name in active_nodes:
+                    active_nodes.discard(name)
+                    yield sse_event("node", {"node": name, "status": "completed"})
+                elif kind == "on_custom_event" and name == "recommendation":
+                    rec = personalize_recommendation(event["data"], survey_data)
+                    if keep_recommendation(rec):
+                        yield sse_event("recommendation", {**rec, "provisional": True})
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = event["data"].get("output")
+        finally:
+            task.cancel()
         
-        return roadmap
-    except Exception as e:
-        print(f"Agent Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
+        roadmap = (final_state or {}).get("final_roadmap")
+        if roadmap:
+            roadmap_cache.set(profile, roadmap)
+            roadmap = filter_recommendations(personalize_roadmap(roadmap, survey_data), survey_data)
+    
+    if not roadmap:
+        yield sse_event("error", {"detail": "Roadmap generation failed"})
+        return
+    
+    await save_user_roadmap(user_id, roadmap)
+    yield sse_event("done", roadmap)
+
+
+@app.post('/roadmap/stream')
+async def stream_roadmap_endpoint(survey: UserSurveyInput, user = Depends(get_current_user)):
+    """
+    Server-Sent Events variant of /roadmap.
+    Emits `node`, `recommendation`, `done` and `error` events as the agent runs.
+    """
+    # User extraction logic (reused)
+    if isinstance(user, tuple):
+        user_obj = user[0]
+    else:
+        user_obj = user
+
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    elif hasattr(user_obj, "id"):
+         user_id = user_obj.id
+    else:
+        raise HTTPException(status_code=400, detail=f"Could not extract user ID from {type(user_obj)}")
+    
+    release = roadmap_streams.acquire()
+    if release is None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many roadmaps are being generated right now. Please retry shortly.",
+            headers={"Retry-After": "30"}
+        )
+    
+    async def event_stream():
+        try:
+            async for message in stream_roadmap_events(survey, user_id):
+                yield message
+        except Exception as e:
+            print(f"Agent Stream Error: {e}")
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the slot if the stream never starts (release is idempotent)
+        background=BackgroundTask(release)
+    )
+
+
+# Comma-separated Supabase user IDs allowed to read /stats; empty disables it for everyone
+STATS_ADMIN_USER_IDS = {u.strip() for u in os.getenv("STATS_ADMIN_USER_IDS", "").split(",") if u.strip()}
+
+
+@app.get('/stats')
+def get_cache_stats(user = Depends(get_current_user)):
+    user_obj = user[0] if isinstance(user, tuple) else user
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    else:
+        user_id = getattr(user_obj, "id", None)
+    if str(user_id) not in STATS_ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Not allowed")
+    from agent.tools import embeddings
+    from agent.impact import analogy_engine
+    from agent.llm_gateway import gateway_stats
+    from agent.search_cache import search_cache
+    return {
+        "roadmap_cache": roadmap_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "embedding_cache": embeddings.stats() if hasattr(embeddings, "stats") else None,
+        "roadmap_jobs": roadmap_workers.stats(),
+        "roadmap_streams": roadmap_streams.stats(),
+        "user_data_cache": user_data_cache.stats(),
+        "impact_analogies": analogy_engine.stats(),
+        "llm_gateway": gateway_stats()
+    }
+
+
+def etag_response(request: Request, data) -> Response:
+    """
+    JSON response tagged with a hash of its body. A request whose If-None-Match
+    already holds that tag gets an empty 304 instead of the payload.
+    """
+    body = json.dumps(jsonable_encoder(data), separators=(",", ":"), sort_keys=True).encode("utf-8")
+    etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get('/dashboard')
-def get_dashboard_data(user = Depends(get_current_user)):
+def get_dashboard_data(request: Request, user = Depends(get_current_user)):
     try:
         # User extraction logic (reused)
         if isinstance(user, tuple):
@@ -169,16 +452,67 @@ def get_dashboard_data(user = Depends(get_current_user)):
         data = get_roadmap(user_id)
         
         if not data:
-            return {"roadmap_data": None}
+            return etag_response(request, {"roadmap_data": None})
             
-        return data
+        return etag_response(request, data)
     except Exception as e:
         print(f"Dashboard Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get('/roadmaps', response_model=RoadmapHistory)
+def list_roadmaps_endpoint(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    user = Depends(get_current_user)
+):
+    # User extraction logic (reused)
+    if isinstance(user, tuple):
+         user_obj = user[0]
+    else:
+         user_obj = user
+
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    elif hasattr(user_obj, "id"):
+         user_id = user_obj.id
+    else:
+        raise HTTPException(status_code=400, detail=f"Could not extract user ID")
+
+    from db import list_roadmaps
+    try:
+        return list_roadmaps(user_id, limit=limit, cursor=cursor)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except Exception as e:
+        print(f"Roadmap History Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get('/roadmaps/{roadmap_id}')
+def get_roadmap_endpoint(roadmap_id: str, request: Request, user = Depends(get_current_user)):
+    # User extraction logic (reused)
+    if isinstance(user, tuple):
+         user_obj = user[0]
+    else:
+         user_obj = user
+
+    if hasattr(user_obj, "user") and user_obj.user:
+        user_id = user_obj.user.id
+    elif hasattr(user_obj, "id"):
+         user_id = user_obj.id
+    else:
+        raise HTTPException(status_code=400, detail=f"Could not extract user ID")
+
+    from db import get_roadmap_by_id
+    data = get_roadmap_by_id(user_id, roadmap_id)
+    if not data:
+        raise HTTPException(status_code=404, detail="Roadmap not found")
+    return etag_response(request, data)
+
+
 @app.get('/impact')
-def get_impact_endpoint(user = Depends(get_current_user)):
+def get_impact_endpoint(request: Request, user = Depends(get_current_user)):
     try:
         # User extraction logic (reused)
         if isinstance(user, tuple):
@@ -197,9 +531,9 @@ def get_impact_endpoint(user = Depends(get_current_user)):
         data = get_impact(user_id)
         
         if not data:
-            return {"impact_data": None}
+            return etag_response(request, {"impact_data": None})
             
-        return data
+        return etag_response(request, data)
     except Exception as e:
         print(f"Impact Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -236,56 +570,26 @@ def generate_impact_endpoint(user = Depends(get_current_user)):
         
         from agent.tools import calculate_co2_impact
         
-        items_for_prompt = []
+        impact_items = []
         for rec in sorted_recs:
              monthly_savings = rec.get("estimated_monthly_savings", 0)
              name = rec.get("name")
              
              co2_tons = calculate_co2_impact(name, monthly_savings)
              
-             items_for_prompt.append({
+             impact_items.append({
                  "name": name,
                  "monthly_savings": monthly_savings,
                  "description": rec.get("explanation"),
                  "co2_saved_tons": co2_tons
              })
 
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-lite",
-            temperature=0.7,
-            api_key=os.environ.get("GOOGLE_API_KEY")
-        )
-
-        prompt = f"""
-        You are an energy efficiency expert. Based on the following home upgrades and their calculated CO2 impact, generate a relatable analogy for each one.
-        
-        For each item:
-        1. Use the provided "co2_saved_tons" value. Do NOT recalculate it.
-        2. Create a fun, relatable analogy for that amount of CO2 (e.g., "driving X miles", "burning Y lbs of coal", "charging Z smartphones").
-        
-        Items:
-        {json.dumps(items_for_prompt, indent=2)}
-        
-        Return ONLY valid JSON in this format:
-        {{
-            "Item Name": {{
-                "analogy": "This is like...",
-                "co2_saved_tons": 0.5  <-- Return the exact value provided
-            }},
-            ...
-        }}
-        """
-
-        response = llm.invoke(prompt)
-        content = response.content
-        
-        # Clean up code blocks if present
-        if "```json" in content:
-            content = content.replace("```json", "").replace("```", "")
-        elif "```" in content:
-            content = content.replace("```", "")
-            
-        impact_breakdown = json.loads(content)
+        # Analogies are computed locally; IMPACT_LLM_ANALOGIES=1 adds cached LLM rewording
+        from agent.impact import analogy_engine, IMPACT_LLM_ANALOGIES
+        llm = None
+        if IMPACT_LLM_ANALOGIES:
+            from agent.tools import llm_flash_lite as llm
+        impact_breakdown = analogy_engine.breakdown(impact_items, llm=llm)
         
         # Calculate total
         total_co2 = sum(item.get("co2_saved_tons", 0) for item in impact_breakdown.values())
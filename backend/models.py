@@ -40,6 +40,18 @@ class AgentRoadmap(BaseModel):
     total_savings: float | None = None
 
 
+class RoadmapSummary(BaseModel):
+    id: int | str
+    created_at: str
+    summary: str | None = None
+    total_savings: float | None = None
+
+
+class RoadmapHistory(BaseModel):
+    items: list[RoadmapSummary]
+    next_cursor: str | None = None
+
+
 class UserImpact(BaseModel):
     user_id: str
     total_co2_saved_tons: float | None = None
@@ -1,34 +1,143 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import tiktoken
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-    text_splitter = RecursiveCharacterTextSplitter(
+# Sizes are in tokens of the embedding model's tokenizer (text-embedding-3-small uses cl100k_base)
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "cl100k_base")
+EMBEDDING_MAX_TOKENS = 8191
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# Set above 1 to chunk documents on a process pool
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0"))
+
+# Upper bound on characters per token, used to size the streaming buffer in chunk_pages
+_MAX_CHARS_PER_TOKEN = 8
+
+@lru_cache(maxsize=None)
+def _encoding():
+    return tiktoken.get_encoding(EMBEDDING_ENCODING)
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text, disallowed_special=()))
+
+@lru_cache(maxsize=16)
+def get_splitter(chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS, add_start_index: bool = False) -> RecursiveCharacterTextSplitter:
+    """One splitter per configuration, built once per process and reused for every document."""
+    if chunk_size > EMBEDDING_MAX_TOKENS:
+        raise ValueError(f"chunk_size {chunk_size} exceeds the embedding model limit of {EMBEDDING_MAX_TOKENS} tokens")
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""]
+        length_function=count_tokens,
+        separators=["\n\n", "\n", ". ", " ", ""],
+        add_start_index=add_start_index
     )
-    
-    chunks = text_splitter.split_text(text)
-    return chunks
-
-def chunk_documents(documents: List[Dict[str, str]], chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Dict]:
-    all_chunks = []
-    
-    for doc in documents:
-        text = doc.get("text", "")
-        metadata = {k: v for k, v in doc.items() if k != "text"}
-        
-        chunks = chunk_text(text, chunk_size, chunk_overlap)
-        
-        for i, chunk in enumerate(chunks):
-            all_chunks.append({
-                "text": chunk,
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    return get_splitter(chunk_size, chunk_overlap).split_text(text)
+
+def _chunk_document(doc: Dict, chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> List[Dict]:
+    text = doc.get("text", "")
+    metadata = {k: v for k, v in doc.items() if k != "text"}
+
+    chunks = chunk_text(text, chunk_size, chunk_overlap)
+
+    return [
+        {
+            "text": chunk,
+            "metadata": {
+                **metadata,
+                "chunk_index": i,
+                "total_chunks": len(chunks)
+            }
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+
+def chunk_documents(documents: Iterable[Dict[str, str]], chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS, workers: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Yield chunks document by document, in input order.
+    With workers > 1 (default CHUNK_WORKERS), documents are split on a process pool,
+    keeping at most 2 * workers documents in flight.
+    """
+    workers = CHUNK_WORKERS if workers is None else workers
+    if workers <= 1:
+        for doc in documents:
+            yield from _chunk_document(doc, chunk_size, chunk_overlap)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for doc in documents:
+            in_flight.append(pool.submit(_chunk_document, doc, chunk_size, chunk_overlap))
+            if len(in_flight) >= 2 * workers:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+def chunk_pages(pages: Iterable[Tuple[int, str]], metadata: Dict, chunk_size: int = CHUNK_SIZE_TOKENS, chunk_overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict]:
+    """
+    Chunk a paged document (e.g. a PDF) one page at a time without holding it all in memory.
+    Text carries over page boundaries, so a chunk may span pages; each chunk records
+    the first and last page it covers in `page_start` / `page_end`.
+    """
+    text_splitter = get_splitter(chunk_size, chunk_overlap, add_start_index=True)
+    # Chunks ending within this many characters of the buffer end are not final yet
+    tail_chars = chunk_size * _MAX_CHARS_PER_TOKEN
+
+    buffer = ""
+    page_starts: List[Tuple[int, int]] = []  # (offset into buffer, page number)
+    chunk_index = 0
+
+    def page_at(offset: int) -> int:
+        page = page_starts[0][1]
+        for start, number in page_starts:
+            if start > offset:
+                break
+            page = number
+        return page
+
+    def flush(final: bool) -> Iterator[Dict]:
+        nonlocal buffer, page_starts, chunk_index
+        pieces = text_splitter.create_documents([buffer])
+        cut = len(buffer)
+        for piece in pieces:
+            start = piece.metadata["start_index"]
+            end = start + len(piece.page_content)
+            # Chunks near the end of the buffer may still merge with the next page's text
+            if not final and end > len(buffer) - tail_chars:
+                cut = start
+                break
+            yield {
+                "text": piece.page_content,
                 "metadata": {
                     **metadata,
-                    "chunk_index": i,
-                    "total_chunks": len(chunks)
+                    "chunk_index": chunk_index,
+                    "page_start": page_at(start),
+                    "page_end": page_at(max(start, end - 1))
                 }
-            })
-    
-    return all_chunks
+            }
+            chunk_index += 1
+        if final:
+            buffer, page_starts = "", []
+        elif cut > 0:
+            page_starts = [(0, page_at(cut))] + [(s - cut, n) for s, n in page_starts if s > cut]
+            buffer = buffer[cut:]
+
+    for page_number, text in pages:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if buffer:
+            buffer += "\n\n"
+        page_starts.append((len(buffer), page_number))
+        buffer += text
+        if len(buffer) >= 3 * tail_chars:
+            yield from flush(final=False)
+
+    if buffer:
+        yield from flush(final=True)
@@ -1,42 +1,49 @@
 import os
 import sys
+import time
+import re
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from dotenv import load_dotenv
 
 # Add parent directory to path to import from db
 sys.path.append(str(Path(__file__).parent.parent))
 
-from pinecone import Pinecone
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from scraper import scrape_webpage, download_pdf
-from chunker import chunk_documents
+from pypdf import PdfReader
+from scraper import scrape_webpages, download_pdf
+from chunker import chunk_documents, chunk_pages, count_tokens
+from manifest import IngestManifest, chunk_id, coverage_fields, document_key
+from agent.coverage import write_coverage_index
+from agent.embedding_cache import with_embedding_cache
+from agent.vector_store import get_vector_store
 
 load_dotenv()
 
+# OpenAI accepts up to 2048 inputs / 300k tokens per embeddings request
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", "100000"))
+EMBED_BATCH_MAX_INPUTS = int(os.getenv("EMBED_BATCH_MAX_INPUTS", "2048"))
+# Pinecone caps upsert requests at 2MB, roughly 100 vectors of 1536 dims with metadata
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+UPSERT_RETRIES = int(os.getenv("UPSERT_RETRIES", "5"))
+# Positional IDs ("<source>_<n>") written before the manifest existed; only needed if the index can't list its IDs
+LEGACY_ID_MAX = int(os.getenv("LEGACY_ID_MAX", "10000"))
+
 # Initialize clients
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-embeddings = OpenAIEmbeddings(
+# Set EMBEDDING_CACHE=disk to reuse vectors across ingestion runs
+embeddings = with_embedding_cache(OpenAIEmbeddings(
     model="text-embedding-3-small",
     openai_api_key=os.getenv("OPENAI_API_KEY")
-)
-
-INDEX_NAME = "hack-earth"
+))
 
 def get_or_create_index():
-    existing_indexes = [index.name for index in pc.list_indexes()]
-    
-    if INDEX_NAME not in existing_indexes:
-        print(f"Creating index {INDEX_NAME}...")
-        pc.create_index(
-            name=INDEX_NAME,
-            dimension=1536,  # text-embedding-3-small dimension
-            metric="cosine",
-            spec={"serverless": {"cloud": "aws", "region": "us-east-1"}}
-        )
-    
-    return pc.Index(INDEX_NAME)
+    # VECTOR_STORE=local writes to the embedded index under data/vector_store instead of Pinecone
+    return get_vector_store(create=True)
 
 def process_austin_energy_pages() -> List[Dict]:
     urls = [
@@ -47,9 +54,7 @@ def process_austin_energy_pages() -> List[Dict]:
     ]
     
     documents = []
-    for url in urls:
-        print(f"Scraping {url}...")
-        result = scrape_webpage(url)
+    for url, result in zip(urls, scrape_webpages(urls)):
         if result["text"]:
             documents.append({
                 "text": result["text"],
@@ -69,9 +74,7 @@ def process_energy_gov_pages() -> List[Dict]:
     ]
     
     documents = []
-    for url in urls:
-        print(f"Scraping {url}...")
-        result = scrape_webpage(url)
+    for url, result in zip(urls, scrape_webpages(urls)):
         if result["text"]:
             documents.append({
                 "text": result["text"],
@@ -85,64 +88,210 @@ def process_energy_gov_pages() -> List[Dict]:
     
     return documents
 
-def process_irs_5695() -> List[Dict]:
-    pdf_path = "irs_5695_2024.pdf"
-    pdf_url = "https://www.irs.gov/pub/irs-pdf/i5695.pdf"
-    
-    if not os.path.exists(pdf_path):
+IRS_5695_PATH = "irs_5695_2024.pdf"
+IRS_5695_URL = "https://www.irs.gov/pub/irs-pdf/i5695.pdf"
+
+def download_irs_5695() -> bool:
+    if not os.path.exists(IRS_5695_PATH):
         print(f"Downloading IRS Form 5695 instructions...")
-        download_pdf(pdf_url, pdf_path)
+        download_pdf(IRS_5695_URL, IRS_5695_PATH)
+    return os.path.exists(IRS_5695_PATH)
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) one page at a time; pypdf parses each page on access."""
+    reader = PdfReader(pdf_path)
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+def process_irs_5695() -> Iterator[Dict]:
+    """Stream the IRS Form 5695 instructions as page-tagged chunks."""
+    if not download_irs_5695():
+        return
+    print(f"Processing {IRS_5695_PATH}...")
+    yield from chunk_pages(iter_pdf_pages(IRS_5695_PATH), {
+        "source": "irs_5695",
+        "location": "federal",
+        "type": "federal_tax_credit",
+        "year": "2024",
+        "url": IRS_5695_URL,
+        "title": "2024 Instructions for Form 5695"
+    })
+
+def token_batches(pending: Iterable[Tuple[str, Dict, int]]) -> Iterator[List[Tuple[str, Dict, int]]]:
+    """Group chunks into embedding requests sized by token count, within the provider's per-request limits."""
+    batch = []
+    batch_tokens = 0
+    for item in pending:
+        tokens = item[2]
+        if batch and (batch_tokens + tokens > EMBED_BATCH_MAX_TOKENS or len(batch) >= EMBED_BATCH_MAX_INPUTS):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def embed_batch(batch: List[Tuple[str, Dict, int]]) -> List[Dict]:
+    texts = [chunk["text"] for _, chunk, _ in batch]
+    batch_embeddings = embeddings.embed_documents(texts)
     
-    documents = []
-    if os.path.exists(pdf_path):
-        print(f"Processing {pdf_path}...")
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-        
-        # Combine all pages into one document
-        full_text = "\n\n".join([page.page_content for page in pages])
-        
-        documents.append({
-            "text": full_text,
-            "source": "irs_5695",
-            "location": "federal",
-            "type": "federal_tax_credit",
-            "year": "2024",
-            "title": "2024 Instructions for Form 5695"
+    vectors = []
+    for (vector_id, chunk, _), embedding in zip(batch, batch_embeddings):
+        vectors.append({
+            "id": vector_id,
+            "values": embedding,
+            "metadata": {
+                **chunk["metadata"],
+                # The whole chunk: it is the only copy retrieval returns, and CHUNK_SIZE_TOKENS
+                # keeps it far below Pinecone's 40 KB metadata limit
+                "text": chunk["text"]
+            }
         })
-    
-    return documents
+    return vectors
 
-def embed_and_upsert(documents: List[Dict], index):
-    print(f"Chunking {len(documents)} documents...")
-    chunks = chunk_documents(documents)
-    
-    print(f"Generated {len(chunks)} chunks. Embedding and upserting...")
-    
-    # Process in batches
-    batch_size = 100
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
-        
-        texts = [chunk["text"] for chunk in batch]
-        batch_embeddings = embeddings.embed_documents(texts)
-        
-        vectors = []
-        for j, (chunk, embedding) in enumerate(zip(batch, batch_embeddings)):
-            vector_id = f"{chunk['metadata'].get('source', 'unknown')}_{i+j}"
-            vectors.append({
-                "id": vector_id,
-                "values": embedding,
-                "metadata": {
-                    **chunk["metadata"],
-                    "text": chunk["text"][:1000]  # Store first 1000 chars in metadata
-                }
-            })
-        
-        index.upsert(vectors=vectors)
-        print(f"Upserted batch {i//batch_size + 1}/{(len(chunks) + batch_size - 1)//batch_size}")
+def upsert_with_retry(index, vectors: List[Dict]):
+    """Upsert one request's worth of vectors, backing off with jitter on transient failures."""
+    for attempt in range(UPSERT_RETRIES + 1):
+        try:
+            index.upsert(vectors=vectors)
+            return len(vectors)
+        except Exception as e:
+            if attempt == UPSERT_RETRIES:
+                raise
+            delay = min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            print(f"Upsert of {len(vectors)} vectors failed ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+_HASHED_ID = re.compile(r"^(.+)_[0-9a-f]{8}_[0-9a-f]{16}$")
+_LEGACY_ID = re.compile(r"^(.+)_\d+$")
+
+def id_source(vector_id: str) -> Optional[str]:
+    """The source name in a content-hashed ("<source>_<url>_<hash>") or legacy ("<source>_<n>") vector ID."""
+    match = _HASHED_ID.match(vector_id) or _LEGACY_ID.match(vector_id)
+    return match.group(1) if match else None
+
+def stale_ids(index, manifest: IngestManifest, current: Dict[str, List[str]], seen: Set[str]) -> List[str]:
+    """
+    IDs in the index that this run didn't produce, for sources that did produce
+    chunks this run. The vectors of manifest documents that weren't re-processed,
+    and every ID of a source that failed this run (e.g. a scrape or PDF error),
+    are left alone so nothing is deleted without a replacement.
+    Used when the manifest can't be trusted to know what's in the index: on
+    the first run, which still has the old positional IDs, and with --full.
+    """
+    sources = {id_source(vector_id) for vector_id in seen}
+    keep = set(seen)
+    for key, ids in manifest.documents.items():
+        if key not in current:
+            keep.update(ids)
+    try:
+        stale = []
+        skipped: Dict[str, int] = {}
+        for vector_id in index.list_ids():
+            if vector_id in keep:
+                continue
+            source = id_source(vector_id)
+            if source in sources:
+                stale.append(vector_id)
+            else:
+                skipped[str(source)] = skipped.get(str(source), 0) + 1
+        for source, count in sorted(skipped.items()):
+            print(f"Keeping {count} vectors from source {source}, which produced no chunks this run")
+        return stale
+    except Exception as e:
+        # Pod-based Pinecone indexes can't list IDs; delete the legacy positional ones by name instead
+        print(f"Could not list index IDs ({e}), deleting legacy positional IDs instead")
+        return [f"{source}_{n}" for source in sorted(sources) for n in range(LEGACY_ID_MAX)]
+
+def embed_and_upsert(chunks: Iterable[Dict], index, full: bool = False) -> IngestManifest:
+    """
+    Incrementally sync `chunks` into the index as they are produced.
+    Only chunks whose stable ID is not in the ingest manifest are embedded and
+    upserted; IDs that a re-processed document no longer produces are deleted.
+    Pass full=True to re-embed everything regardless of the manifest. In that
+    case, or when there is no manifest yet, every other ID in the index is
+    deleted afterwards (see stale_ids).
+
+    Runs as a pipeline: while batch N is being upserted (in parallel, with
+    retries), batch N+1 is already being embedded. Returns the saved manifest.
+    """
+    manifest = IngestManifest()
+    reset = full or not manifest.exists
+    known_ids = set() if reset else manifest.known_ids()
+    
+    current: Dict[str, List[str]] = {}
+    coverage: Dict[str, Dict] = {}
+    seen = set()
+    counts = {"total": 0, "tokens": 0}
+    
+    def new_chunks():
+        # Consumes the chunk stream lazily so large documents never sit in memory
+        for chunk in chunks:
+            counts["total"] += 1
+            vector_id = chunk_id(chunk)
+            key = document_key(chunk["metadata"])
+            current.setdefault(key, []).append(vector_id)
+            coverage.setdefault(key, coverage_fields(chunk["metadata"]))
+            if vector_id not in known_ids and vector_id not in seen:
+                tokens = count_tokens(chunk["text"])
+                counts["tokens"] += tokens
+                yield vector_id, chunk, tokens
+            seen.add(vector_id)
+    
+    started = time.perf_counter()
+    upserted = 0
+    in_flight = deque()
+    
+    def schedule_upserts(vectors):
+        for i in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            in_flight.append(upsert_pool.submit(upsert_with_retry, index, vectors[i:i + UPSERT_BATCH_SIZE]))
+    
+    def reap(limit: int) -> int:
+        done = 0
+        while len(in_flight) > limit:
+            done += in_flight.popleft().result()
+        return done
     
-    print(f"✅ Successfully embedded and upserted {len(chunks)} chunks!")
+    with ThreadPoolExecutor(max_workers=1) as embed_pool, \
+            ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as upsert_pool:
+        embedding = None
+        batches = 0
+        for batch in token_batches(new_chunks()):
+            next_embedding = embed_pool.submit(embed_batch, batch)
+            if embedding is not None:
+                schedule_upserts(embedding.result())
+            embedding = next_embedding
+            batches += 1
+            # Bound the vectors held in memory waiting for an upsert slot
+            upserted += reap(2 * UPSERT_CONCURRENCY)
+            print(f"Embedding batch {batches} ({len(batch)} chunks, {upserted} upserted so far)")
+        if embedding is not None:
+            schedule_upserts(embedding.result())
+        upserted += reap(0)
+    
+    elapsed = time.perf_counter() - started
+    
+    orphans = stale_ids(index, manifest, current, seen) if reset else manifest.orphaned_ids(current)
+    for i in range(0, len(orphans), 1000):
+        index.delete(ids=orphans[i:i + 1000])
+    if orphans:
+        print(f"Deleted {len(orphans)} stale vectors")
+    # The local store buffers writes in memory; this writes them to disk once
+    index.flush()
+    
+    manifest.update(current, coverage)
+    manifest.save()
+    
+    print(f"✅ Successfully embedded and upserted {upserted} chunks ({counts['total'] - upserted} unchanged)!")
+    if upserted:
+        print(
+            f"Throughput: {upserted / elapsed:.1f} chunks/s, "
+            f"{counts['tokens'] / elapsed:.0f} tokens/s over {elapsed:.1f}s"
+        )
+    if hasattr(embeddings, "stats"):
+        print(f"Embedding cache: {embeddings.stats()}")
+    return manifest
 
 def main():
     print("Starting RAG embedding pipeline...")
@@ -151,17 +300,23 @@ def main():
     
     all_documents = []
     
-    print("\n=== Processing Austin Energy ===")
-    all_documents.extend(process_austin_energy_pages())
-    
-    print("\n=== Processing Energy.gov ===")
-    all_documents.extend(process_energy_gov_pages())
-    
-    print("\n=== Processing IRS Form 5695 ===")
-    all_documents.extend(process_irs_5695())
+    # Sources live on different hosts, so fetch them all at once
+    print("\n=== Processing Austin Energy, Energy.gov and IRS Form 5695 ===")
+    sources = [process_austin_energy_pages, process_energy_gov_pages, download_irs_5695]
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        austin_documents, energy_gov_documents, _ = pool.map(lambda process: process(), sources)
+    all_documents.extend(austin_documents)
+    all_documents.extend(energy_gov_documents)
     
     print(f"\n=== Embedding and Uploading ===")
-    embed_and_upsert(all_documents, index)
+    # Web pages are small; the PDF is chunked page by page as the upsert consumes it
+    chunks = chain(chunk_documents(all_documents), process_irs_5695())
+    # --full ignores the manifest and re-embeds every chunk
+    manifest = embed_and_upsert(chunks, index, full="--full" in sys.argv)
+    
+    print(f"\n=== Updating Zip Coverage Index ===")
+    # Built from every source still in the index, not just the ones scraped successfully this run
+    write_coverage_index(manifest.coverage_documents())
     
     print("\n🎉 All done!")
 
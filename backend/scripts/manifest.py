@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Set
+
+from agent.vector_store import VECTOR_STORE
+
+# One manifest per vector store backend, since each holds its own copy of the vectors
+MANIFEST_PATH = os.getenv(
+    "INGEST_MANIFEST_PATH",
+    str(Path(__file__).parent.parent / "data" / f"ingest_manifest_{VECTOR_STORE}.json")
+)
+
+# Positional fields that shift whenever a page changes length; they must not affect IDs
+_UNSTABLE_FIELDS = {"chunk_index", "total_chunks"}
+# Document fields the zip coverage index is built from
+COVERAGE_FIELDS = ("zip_codes", "type", "location")
+
+
+def document_key(metadata: Dict) -> str:
+    """The page a chunk came from: its URL, or the source name for files without one."""
+    return metadata.get("url") or metadata.get("source", "unknown")
+
+
+def chunk_id(chunk: Dict) -> str:
+    """
+    Stable vector ID from the source URL plus a hash of the chunk's content and metadata.
+    The same chunk always gets the same ID, wherever it lands in the page.
+    """
+    metadata = chunk["metadata"]
+    stable_metadata = {k: v for k, v in metadata.items() if k not in _UNSTABLE_FIELDS}
+    url_hash = hashlib.sha1(document_key(metadata).encode("utf-8")).hexdigest()[:8]
+    content_hash = hashlib.sha1(
+        (chunk["text"] + json.dumps(stable_metadata, sort_keys=True)).encode("utf-8")
+    ).hexdigest()[:16]
+    return f"{metadata.get('source', 'unknown')}_{url_hash}_{content_hash}"
+
+
+def coverage_fields(metadata: Dict) -> Dict:
+    return {k: metadata[k] for k in COVERAGE_FIELDS if metadata.get(k)}
+
+
+class IngestManifest:
+    """
+    Records which vector IDs are currently in the index for each source document,
+    along with the fields the zip coverage index needs for that document.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.exists = bool(data)
+        self.documents: Dict[str, List[str]] = data.get("documents", {})
+        self.coverage: Dict[str, Dict] = data.get("coverage", {})
+
+    def known_ids(self) -> Set[str]:
+        return {vector_id for ids in self.documents.values() for vector_id in ids}
+
+    def orphaned_ids(self, current: Dict[str, List[str]]) -> List[str]:
+        """
+        IDs previously stored for documents re-processed in this run that the
+        current chunks no longer produce. Documents missing from this run (e.g. a
+        failed scrape) are left untouched rather than wiped from the index.
+        """
+        orphans = []
+        for key, ids in current.items():
+            keep = set(ids)
+            orphans.extend(i for i in self.documents.get(key, []) if i not in keep)
+        return orphans
+
+    def update(self, current: Dict[str, List[str]], coverage: Dict[str, Dict]):
+        self.documents.update({key: sorted(set(ids)) for key, ids in current.items()})
+        self.coverage.update(coverage)
+
+    def coverage_documents(self) -> List[Dict]:
+        """
+        Coverage fields for every document that still has vectors in the index,
+        including ones whose scrape failed this run and were left in place.
+        """
+        return [self.coverage[key] for key in self.documents if key in self.coverage]
+
+    def save(self):
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"documents": self.documents, "coverage": self.coverage}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
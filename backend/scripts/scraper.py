@@ -1,57 +1,173 @@
+import os
+import json
+import hashlib
+import threading
 import requests
+from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", str(Path(__file__).parent.parent / "data" / "http_cache"))
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "16"))
+SCRAPE_PER_HOST = int(os.getenv("SCRAPE_PER_HOST", "4"))
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0',
+}
+
+# One pooled session for the whole ingest run so connections are reused per host
+session = requests.Session()
+session.headers.update(HEADERS)
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(SCRAPE_PER_HOST, 8))
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+_host_limits: Dict[str, threading.Semaphore] = {}
+_host_limits_lock = threading.Lock()
+
+
+def _host_limit(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.Semaphore(SCRAPE_PER_HOST)
+        return _host_limits[host]
+
+
+class ResponseCache:
+    """
+    On-disk cache of page bodies and their parsed text, keyed by URL.
+    Stores ETag / Last-Modified so unchanged pages are revalidated with a
+    conditional GET (304) instead of being downloaded and parsed again.
+    """
+
+    def __init__(self, directory: str = HTTP_CACHE_DIR):
+        self.directory = Path(directory)
+
+    def _paths(self, url: str):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.json", self.directory / f"{key}.body"
+
+    def load(self, url: str) -> Optional[Dict]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            meta["body"] = body_path.read_bytes()
+            return meta
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict[str, str]:
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self, url: str, response: requests.Response, parsed: Optional[Dict] = None):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_path, body_path = self._paths(url)
+        body_path.write_bytes(response.content)
+        with open(meta_path, "w") as f:
+            json.dump({"url": url, "etag": etag, "last_modified": last_modified, "parsed": parsed}, f)
+
+
+response_cache = ResponseCache()
+
+
+def fetch(url: str, timeout: int = 30) -> Dict:
+    """
+    GET `url` through the shared session, honoring the per-host concurrency
+    limit and revalidating against the response cache.
+    Returns {"content": bytes, "cached": bool, "entry": cache entry or None, "response": Response or None}.
+    """
+    entry = response_cache.load(url)
+    with _host_limit(url):
+        response = session.get(url, headers=response_cache.conditional_headers(entry), timeout=timeout)
+    if response.status_code == 304 and entry:
+        return {"content": entry["body"], "cached": True, "entry": entry, "response": None}
+    response.raise_for_status()
+    return {"content": response.content, "cached": False, "entry": None, "response": response}
+
+
+def parse_html(content: bytes, url: str) -> Dict[str, str]:
+    """HTML -> text extraction. Runs on the fetch thread that downloaded the page (see scrape_webpages)."""
+    soup = BeautifulSoup(content, 'html.parser')
+
+    for script in soup(["script", "style", "nav", "footer", "header"]):
+        script.decompose()
+
+    text = soup.get_text(separator='\n', strip=True)
+
+    lines = (line.strip() for line in text.splitlines())
+    text = '\n'.join(line for line in lines if line)
+
+    title = soup.find('title')
+    title_text = title.string if title else url
+
+    return {
+        "text": text,
+        "title": str(title_text),
+        "url": url
+    }
+
 
 def scrape_webpage(url: str) -> Dict[str, str]:
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Cache-Control': 'max-age=0',
-        }
-        
-        session = requests.Session()
-        response = session.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.decompose()
-        
-        text = soup.get_text(separator='\n', strip=True)
-        
-        lines = (line.strip() for line in text.splitlines())
-        text = '\n'.join(line for line in lines if line)
-        
-        title = soup.find('title')
-        title_text = title.string if title else url
-        
-        return {
-            "text": text,
-            "title": str(title_text),
-            "url": url
-        }
+        fetched = fetch(url)
+        if fetched["cached"] and fetched["entry"].get("parsed"):
+            print(f"Unchanged: {url}")
+            return fetched["entry"]["parsed"]
+
+        print(f"Scraped {url}")
+        parsed = parse_html(fetched["content"], url)
+        if fetched["response"] is not None and parsed["text"]:
+            response_cache.save(url, fetched["response"], parsed)
+        return parsed
     except Exception as e:
         print(f"Error scraping {url}: {e}")
         return {"text": "", "title": "", "url": url}
 
+
+def scrape_webpages(urls: List[str]) -> List[Dict[str, str]]:
+    """
+    Scrape many pages at once on a thread pool (bounded per host), parsing each
+    page on the thread that downloaded it. Results are returned in `urls` order.
+    """
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(SCRAPE_MAX_WORKERS, len(urls))) as pool:
+        return list(pool.map(scrape_webpage, urls))
+
+
 def download_pdf(url: str, save_path: str) -> bool:
     try:
-        response = requests.get(url, timeout=30)
+        with _host_limit(url):
+            response = session.get(url, timeout=30)
         response.raise_for_status()
-        
+
         with open(save_path, 'wb') as f:
             f.write(response.content)
-        
+
         print(f"Downloaded PDF to {save_path}")
         return True
     except Exception as e:
@@ -67,7 +67,7 @@ export default function DashboardPage() {
         );
     }
 
-    const { total_projected_savings_yearly, recommendations, summary_text } = roadmapData;
+    const { total_projected_savings_yearly, recommendations, summary_text, prepared_for } = roadmapData;
     
     // Calculate derived stats from funding breakdown
     const totalPotentialRebates = recommendations.reduce((total: number, rec: any) => {
@@ -79,7 +79,9 @@ export default function DashboardPage() {
         <div className="mx-auto w-full">
             <header className="mb-8 flex flex-col lg:flex-row lg:items-center justify-between gap-6">
                 <div>
-                    <h1 className="text-3xl font-bold text-text-primary tracking-tight">Your Green Roadmap</h1>
+                    <h1 className="text-3xl font-bold text-text-primary tracking-tight">
+                        {prepared_for ? `${prepared_for}'s Green Roadmap` : "Your Green Roadmap"}
+                    </h1>
                     <p className="text-text-secondary mt-2 max-w-2xl text-base leading-relaxed">{summary_text}</p>
                 </div>
             </header>
@@ -104,7 +104,23 @@ export default function SurveyPage() {
           // We still redirect to dashboard, maybe show an error toast there or allow retry?
           // For now, let's just proceed as the user data is saved.
       } else {
-          console.log("Roadmap generated successfully");
+          // Generation runs as a background job; poll until it finishes
+          const { job_id } = await roadmapRes.json();
+          let status = "queued";
+          while (status === "queued" || status === "running") {
+              await new Promise((resolve) => setTimeout(resolve, 2000));
+              const jobRes = await fetch(`http://localhost:8000/roadmap/jobs/${job_id}`, {
+                  headers: { "Authorization": `Bearer ${token}` }
+              });
+              if (!jobRes.ok) break;
+              status = (await jobRes.json()).status;
+          }
+
+          if (status === "done") {
+              console.log("Roadmap generated successfully");
+          } else {
+              console.error("Failed to generate roadmap");
+          }
       }
 
       router.push("/dashboard");
@@ -20,4 +20,5 @@ export interface RoadmapOutput {
     total_projected_savings_yearly: number;
     recommendations: ComponentRecommendation[];
     summary_text: string;
+    prepared_for?: string;
 }